@@ -0,0 +1,41 @@
+"""Compare the old per-message binning loop against the numpy version in data.py
+
+Run with `pipenv run python bench/binning.py`
+"""
+import os
+import sys
+import time
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from data import bin_timestamps  # noqa: E402
+
+
+def old_binning(timestamps, begin, n_bins):
+    """What `Data.get_y` used to do"""
+    y = np.zeros(n_bins)
+    for msg_time in timestamps:
+        y[int((msg_time - begin) / 3600)] += 1
+    return y
+
+
+def main():
+    n_bins = 24 * 30
+    begin = time.time() - n_bins * 3600
+    # the list column includes turning a python list into an array, which is most of the cost at this point
+    print(f'{"messages":>10} {"loop (ms)":>12} {"numpy, list (ms)":>17} {"numpy, array (ms)":>18} {"speedup":>8}')
+    for n in (10_000, 100_000, 1_000_000):
+        timestamps = sorted(np.random.uniform(begin, begin + n_bins * 3600, n).tolist())
+        assert np.array_equal(old_binning(timestamps, begin, n_bins), bin_timestamps(timestamps, begin, n_bins))
+        repeats = 3
+        old = min(timeit.repeat(lambda: old_binning(timestamps, begin, n_bins), number=1, repeat=repeats))
+        new = min(timeit.repeat(lambda: bin_timestamps(timestamps, begin, n_bins), number=1, repeat=repeats))
+        array = np.array(timestamps)
+        arr = min(timeit.repeat(lambda: bin_timestamps(array, begin, n_bins), number=1, repeat=repeats))
+        print(f'{n:>10} {old * 1000:>12.2f} {new * 1000:>17.2f} {arr * 1000:>18.2f} {old / arr:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Compare drawing the line graph as one LineCollection per channel against the old interpolated scatter plot
+
+Run with `pipenv run python bench/render.py`
+"""
+import os
+import sys
+import datetime
+import timeit
+
+import numpy as np
+import matplotlib
+import matplotlib.path as mpath
+import matplotlib.colors as colors
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import render  # noqa: E402
+from smoothing import smooth  # noqa: E402
+
+
+def interpolate(x, y, steps=5):
+    path = mpath.Path(np.column_stack([x, y]))
+    verts = path.interpolated(steps=steps).vertices
+    return verts[:, 0], verts[:, 1]
+
+
+def scatter_line_graph(x, series):
+    """What `render.line_graph` used to do"""
+    with matplotlib.rc_context(render.STYLE):
+        fig, ax = render.preplot_styling(x, 'Messages per hour')
+        global_max = max(y.max() for _, y, _ in series)
+        norm = colors.Normalize(vmin=-global_max / 1.5, vmax=global_max * 2.5)
+        for name, y, colormap in series:
+            xs, ys = interpolate(x, y)
+            xs = [datetime.datetime.utcfromtimestamp(t) for t in xs]
+            ax.scatter(xs, ys, label=name, c=ys, s=10, cmap=colormap, norm=norm)
+        render.postplot_styling(fig, ax, series)
+        return render.as_png(fig)
+
+
+def main():
+    end = 1800000000 // 3600 * 3600
+    x = np.arange(end - 720 * 3600, end, 3600)
+    rng = np.random.default_rng(0)
+    colormaps = ["Reds_r", "YlOrBr_r", "Greens_r", "Blues_r", "Purples_r", "cividis"]
+    series = [(f'channel {i}', smooth(rng.poisson(30 / (i + 1), len(x)).astype(float), 13), cmap)
+              for i, cmap in enumerate(colormaps)]
+
+    print(f'{"renderer":>16} {"time (ms)":>10} {"png (KiB)":>10}')
+    for name, func in (('scatter', scatter_line_graph), ('LineCollection', render.line_graph)):
+        func(x, series)  # warm up, so font caches and such don't count
+        seconds = min(timeit.repeat(lambda: func(x, series), number=1, repeat=5))
+        print(f'{name:>16} {seconds * 1000:>10.1f} {len(func(x, series)) / 1024:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""An on-disk archive of one channel's message ids, that can be read without loading it all into memory
+
+Ids are kept oldest first in a file of little-endian uint64s, which only ever gets added on to the end (unless we go
+back and fetch older history, which rewrites it).  Alongside it, the .idx file has every INDEX_EVERY-th id, which is
+small enough to keep in memory.  Looking up a range of time finds the right blocks in that, then binary searches in
+just those blocks of the memory mapped file, and hands back a numpy view of it without copying anything.
+"""
+import os
+
+import numpy as np
+
+INDEX_EVERY = 4096
+DTYPE = np.dtype('<u8')
+
+
+def write_atomic(path, data):
+    """Replace the file at `path` with some bytes.  They're written to a temporary file that's then renamed over it,
+    so a crash halfway through never leaves a broken file behind"""
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+class Archive:
+    """The archive of message ids in the file at `path`"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.mm = None  # a memory map of the ids, or None if it needs (re)making
+        self.index = None
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def ids(self):
+        """All the ids, as a read only numpy array backed by the file"""
+        n = len(self)
+        if self.mm is None or len(self.mm) != n:
+            # numpy can't map an empty file
+            self.mm = np.memmap(self.path, DTYPE, 'r', shape=(n,)) if n else np.zeros(0, DTYPE)
+            self.index = None
+        if self.index is None:
+            try:
+                self.index = np.fromfile(self.index_path, DTYPE)
+            except FileNotFoundError:
+                self.index = np.zeros(0, DTYPE)
+        return self.mm
+
+    def between(self, start, end):
+        """A view of the ids in [start, end), found with the sparse index and a binary search"""
+        ids = self.ids()
+        # block i starts at ids[i * INDEX_EVERY], which is index[i]
+        first_block = max(int(np.searchsorted(self.index, start, 'right')) - 1, 0)
+        lo = first_block * INDEX_EVERY
+        hi = min(int(np.searchsorted(self.index, end, 'left')) * INDEX_EVERY, len(ids))
+        if hi <= lo:
+            return ids[lo:lo]
+        block = ids[lo:hi]
+        return block[np.searchsorted(block, start, 'left'):np.searchsorted(block, end, 'left')]
+
+    def append(self, new_ids):
+        """Add ids that are newer than everything already archived on to the end"""
+        if not len(new_ids):
+            return
+        n_old = len(self)
+        new_ids = np.asarray(new_ids, DTYPE)
+        with open(self.path, 'ab') as f:
+            f.write(new_ids.tobytes())
+        # index entries for any of the new ids that land on a multiple of INDEX_EVERY
+        first = -n_old % INDEX_EVERY
+        with open(self.index_path, 'ab') as f:
+            f.write(new_ids[first::INDEX_EVERY].tobytes())
+        self.mm = None
+
+    def prepend(self, old_ids):
+        """Add ids that are older than everything already archived on to the start.  This rewrites the whole file"""
+        if not len(old_ids):
+            return
+        ids = np.concatenate([np.asarray(old_ids, DTYPE), self.ids()])
+        self.mm = None
+        write_atomic(self.path, ids.tobytes())
+        write_atomic(self.index_path, ids[::INDEX_EVERY].tobytes())
+
+    def remove(self):
+        self.mm = None
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -1,10 +1,103 @@
-import os
+import time
+import bisect
 import pprint
-import asyncio
 import traceback
-from datetime import datetime, timedelta
+from datetime import datetime
+from collections import deque, namedtuple
 
 from discord.ext import commands
+import discord
+
+# how long (in seconds) a guild's channels have to stop moving for before we say what happened
+QUIET_TIME = 1
+# the most moves we keep for one guild at once.  Bulk reorganizing bots can make hundreds; past this the oldest go
+MAX_MOVES = 500
+
+# one channel changing position, at some unix time
+Move = namedtuple('Move', ('channel_id', 'old_pos', 'new_pos', 'ts'))
+
+
+def longest_increasing(seq):
+    """The indexes of a longest strictly increasing subsequence of `seq`, in O(n log n)"""
+    tails = []  # tails[k] is the index of the smallest value that ends an increasing run of length k + 1
+    tail_values = []
+    prev = [None] * len(seq)  # index of the value before each one in its run
+    for i, x in enumerate(seq):
+        k = bisect.bisect_left(tail_values, x)
+        if k:
+            prev[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(x)
+        else:
+            tails[k] = i
+            tail_values[k] = x
+    run = []
+    i = tails[-1] if tails else None
+    while i is not None:
+        run.append(i)
+        i = prev[i]
+    return run[::-1]
+
+
+def rearrangement(moves, text_channels):
+    """The channel orders before and after a burst of moves, as lists of channel ids from top to bottom
+
+    Channels that didn't move are where they are now, which is also where they were.  A channel that moved a few times
+    started at its first old position and ended at its last new one.
+    """
+    after = {channel.id: channel.position for channel in text_channels}
+    before = dict(after)
+    seen = set()
+    for move in moves:
+        if move.channel_id not in seen:
+            seen.add(move.channel_id)
+            before[move.channel_id] = move.old_pos
+        after[move.channel_id] = move.new_pos
+    # discord breaks ties in position by id
+    return (sorted(before, key=lambda chan_id: (before[chan_id], chan_id)),
+            sorted(after, key=lambda chan_id: (after[chan_id], chan_id)))
+
+
+def minimal_moves(before, after):
+    """The fewest channels that could have been dragged to get from one order to another
+
+    Everything in a longest run of channels that are in the same order in both stayed put, and the rest moved.
+    Returns a list of (channel id, index before, index after), top to bottom in the new order.
+    """
+    after_index = {chan_id: i for i, chan_id in enumerate(after)}
+    stayed = {before[i] for i in longest_increasing([after_index[chan_id] for chan_id in before])}
+    before_index = {chan_id: i for i, chan_id in enumerate(before)}
+    return [(chan_id, before_index[chan_id], i) for i, chan_id in enumerate(after) if chan_id not in stayed]
+
+
+def describe(moves, text_channels):
+    """Work out what happened from a burst of moves in one guild, and say it in one message
+
+    Returns None if everything ended up back where it started.
+    """
+    before, after = rearrangement(moves, text_channels)
+    moved = minimal_moves(before, after)
+    lines = []
+    for chan_id, old, new in moved:
+        if len(moved) == 1 and abs(old - new) == 1:
+            lines.append('<#{}> swapped with <#{}>'.format(chan_id, before[new]))
+        elif old == 0:
+            lines.append('<#{}> was dragged from the top to after <#{}>'.format(chan_id, after[new - 1]))
+        elif new == 0:
+            lines.append('<#{}> was dragged from after <#{}> to the top'.format(chan_id, before[old - 1]))
+        else:
+            lines.append('<#{}> was dragged from after <#{}> to after <#{}>'.format(
+                chan_id, before[old - 1], after[new - 1]))
+    if len(lines) <= 1:
+        return lines[0] if lines else None
+    # keep it to one message, under discord's length limit
+    msg = f'{len(lines)} channels were rearranged:'
+    for i, line in enumerate(lines):
+        if len(msg) + len(line) > 1900:
+            return msg + f'\n...and {len(lines) - i} more'
+        msg += '\n' + line
+    return msg
 
 
 class ChannelListener(commands.Cog):
@@ -12,111 +105,81 @@ class ChannelListener(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        # guild id: deque of Moves since the guild's channels were last still
         self.chan_changes = dict()
-        self.task = self.bot.loop.create_task(self.listener())
+        # guild id: asyncio.TimerHandle, for when that guild's channels should be done moving
+        self.timers = dict()
 
-    def __unload(self):
-        if self.task is not None:
-            self.task.cancel()
-            print('cancelled task')
+    def cog_unload(self):
+        for timer in self.timers.values():
+            timer.cancel()
 
     # https://discordpy.readthedocs.io/en/latest/api.html#discord.on_guild_channel_update
     @commands.Cog.listener()
     async def on_guild_channel_update(self, before, after):
         """Listen for channel update events, and record them
 
-        This stores data in a temporary place, to be looked at by a background task, rather than analyzing it itself.
+        This stores data in a temporary place, to be looked at once things calm down, rather than analyzing it itself.
         This is because if channel #2 is dragged after channel #5, this method will be called for channels 2, 3, 4, & 5
-        (as each one is decremented except for #2), and we only want to send one message rather than four
+        (as each one is decremented except for #2), and we only want to send one message rather than four.
+        Only text channels count: voice channels and categories are numbered separately, so mixing them in would
+        make it look like text channels moved when they didn't.
         """
-        if before.position != after.position:
+        if isinstance(after, discord.TextChannel) and before.position != after.position:
             print('#{} moved from position {} to {}'.format(before.name, before.position, after.position))
-            if before.guild.id not in self.chan_changes:
-                self.chan_changes[before.guild.id] = []
-            self.chan_changes[before.guild.id].append((datetime.now(), before, after))
-
-            print(self.chan_changes)
-
-    async def listener(self):
-        """A background task that monitors the recently-changed channels, and tells about it in a channel"""
-        await self.bot.wait_until_ready()
-        for guild in self.bot.guilds:
-            self.chan_changes[guild.id] = []  # init stuff
-        # Logging channels: a dict of server ids pointing to log channel ids
-        log_channels = {325354209673216010: 325354209673216010, 391743485616717824:568975675252408330}
-        print('listener task begun')
-        while True:
-            log_channels = self.bot.db['CHANNEL_REARRANGING']['log_channels']
-            await asyncio.sleep(1)
-            for guild in self.bot.guilds:
-                changes = self.chan_changes[guild.id] if guild.id in self.chan_changes else []
-                if len(changes) > 0:
-                    # wrap all the useful stuff in try-catch so we don't silently and permanently fail on error
-                    try:
-                        latest_change = max([chan[0] for chan in changes])
-                        # wait for everything to calm down before complaining.  Don't wanna log something if ongoing
-                        if (datetime.now() - latest_change) > timedelta(seconds=.3):
-                            print('channels moved!')
-                            log_chan = self.bot.get_channel(log_channels[str(guild.id)])
-                            # the `changes` list, but sorted from top to bottom as seen before the drag event
-                            sorted_begins = sorted(changes, key=lambda chan: chan[1].position)
-                            if len(changes) < 2:
-                                await log_chan.send('I\'m really unsure what just happened.')
-                            elif sorted_begins[-1][1].position - sorted_begins[0][1].position is 1:
-                                await log_chan.send('<#{}> swapped with <#{}>'.format(changes[0][1].id, changes[1][1].id))
-                            else:
-                                # a channel was dragged far above or far below where it was previously
-
-                                # the before and after version of the channel that someone dragged
-                                dragged_chan = [chan[1:3] for chan in changes if 1<abs(chan[1].position-chan[2].position)][0]
-
-                                # print the of the dragged channel's name (before-version, technically)
-                                print(dragged_chan[0].name)
-
-                                # case: channel was dragged far upward
-                                if dragged_chan[0].position > dragged_chan[1].position:
-                                    start_after_chan = sorted_begins[-2][1]
-                                    end_above_chan = sorted_begins[0][1]
-                                    await log_chan.send('<#{}> was dragged from after <#{}> to above <#{}>'.format(
-                                        dragged_chan[0].id, start_after_chan.id, end_above_chan.id))
-
-                                # case: channel was dragged far downward
-                                else:
-                                    start_after_chan_pos = sorted_begins[0][1].position - 1
-                                    end_above_chan = sorted_begins[-1][1]
-
-                                    if start_after_chan_pos < 0:
-                                        await log_chan.send('<#{}> was dragged from the top to after <#{}>'.format(
-                                            dragged_chan[0].id, end_above_chan.id))
-
-                                    else:
-                                        start_after_chan = self.bot.get_guild(guild.id).text_channels[start_after_chan_pos]
-                                        await log_chan.send('<#{}> was dragged from after <#{}> to after <#{}>'.format(
-                                            dragged_chan[0].id, start_after_chan.id, end_above_chan.id))
-
-                            # clear our cache of channel changes.  Don't wanna double-report stuff
-                            self.chan_changes[guild.id] = []
-
-                    # We don't want to silently crash if we somehow encounter an error in this.
-                    # Thus, we implement our own error catcher
-                    except Exception as e:
-                        # windows doesn't like colons, so replace them
-                        now_str = datetime.utcnow().isoformat().replace(':', '_').replace('-', '_')
-                        with open(f'logs/channel_listener_error_dump_{now_str}.txt', 'w') as f:
-                            f.write('Contents of self.chan_changes: \n\n')
-                            f.write(pprint.pformat(self.chan_changes))
-                            f.write('\n\nTraceback:\n\n')
-                            f.write(traceback.format_exc())
-                        self.chan_changes = dict()  # needs to be cleared or we'll keep throwing the same error
-                        try:
-                            log_chan = self.bot.get_channel(log_channels[str(guild.id)])
-                            await log_chan.send("Oy, some channels moved but I had problems understanding what "
-                                                "happened.  I got an error like `{}`.".format(e))
-                            ids = {chan[1].id for chan in changes}  # eliminate repeated elements by using set
-                            outs = "<#" + ">, <#".join(str(e) for e in ids) + ">"
-                            await log_chan.send("It involved these channels: " + outs)
-                        except Exception:
-                            traceback.print_exc()
+            guild_id = before.guild.id
+            if guild_id not in self.chan_changes:
+                self.chan_changes[guild_id] = deque(maxlen=MAX_MOVES)
+            self.chan_changes[guild_id].append(Move(before.id, before.position, after.position, time.time()))
+
+            # wait for everything to calm down before complaining.  Don't wanna log something if ongoing, so every
+            # move in the guild pushes the report back a bit more
+            timer = self.timers.get(guild_id)
+            if timer is not None:
+                timer.cancel()
+            self.timers[guild_id] = self.bot.loop.call_later(QUIET_TIME, self.settled, guild_id)
+
+    def settled(self, guild_id):
+        """Called once a guild's channels have stopped moving for a bit"""
+        self.timers.pop(guild_id, None)
+        self.bot.loop.create_task(self.report(guild_id))
+
+    async def report(self, guild_id):
+        """Work out how the channels in a guild were rearranged, and tell about it in the guild's log channel"""
+        # Logging channels: a dict of str(server ids) pointing to log channel ids
+        log_channels = self.bot.db['CHANNEL_REARRANGING']['log_channels']
+        guild = self.bot.get_guild(guild_id)
+        # clear our cache of channel changes.  Don't wanna double-report stuff
+        moves = self.chan_changes.pop(guild_id, ())
+        if guild is None or len(moves) == 0 or str(guild_id) not in log_channels:
+            return
+        log_chan = self.bot.get_channel(log_channels[str(guild_id)])
+        # wrap all the useful stuff in try-catch so we don't silently and permanently fail on error.
+        # Whatever goes wrong only has to do with this guild's moves, so nobody else's get thrown away
+        try:
+            print('channels moved!')
+            msg = describe(moves, guild.text_channels)
+            if msg is not None:
+                await log_chan.send(msg)
+
+        # We don't want to silently crash if we somehow encounter an error in this.
+        # Thus, we implement our own error catcher
+        except Exception as e:
+            # windows doesn't like colons, so replace them
+            now_str = datetime.utcnow().isoformat().replace(':', '_').replace('-', '_')
+            with open(f'logs/channel_listener_error_dump_{now_str}.txt', 'w') as f:
+                f.write(f'Moves in guild {guild_id}: \n\n')
+                f.write(pprint.pformat(list(moves)))
+                f.write('\n\nTraceback:\n\n')
+                f.write(traceback.format_exc())
+            try:
+                await log_chan.send("Oy, some channels moved but I had problems understanding what "
+                                    "happened.  I got an error like `{}`.".format(e))
+                ids = {move.channel_id for move in moves}  # eliminate repeated elements by using set
+                outs = "<#" + ">, <#".join(str(e) for e in ids) + ">"
+                await log_chan.send("It involved these channels: " + outs)
+            except Exception:
+                traceback.print_exc()
 
 
 def setup(bot):
@@ -1,101 +1,148 @@
+import asyncio
 import datetime
-import toml
 import io
-import sqlite3
+import time
+import typing
+from array import array
+from collections import OrderedDict
 
 import discord
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.path as mpath
-import matplotlib.dates as mdates
-import matplotlib.colors as colors
-import matplotlib.cm as cm
 from discord.ext import commands
-from scipy.ndimage.filters import gaussian_filter1d
-
-
-class Channel:
-    """Data struct for the things I care about in a channel"""
-
-    def __init__(self, name, data):
-        self.name = name
-        self.timestamps = data  # timestamps of all messages sent in last month in channel
-        self.y = None  # smoothed and binned timestamps
-        self.colormap = None
-
-
-def get_max(chans):
-    """Fetches the global maximum of a list of channels"""
-    max_y = 0
-    for channel in chans:
-        max_y = max(max_y, max(channel.y))
-    return max_y
-
-
-def get_min(chans):
-    """Fetches the global minimum of a list of channels"""
-    # since all our data is timestamps is the past,
-    # taking the timestamp of now will be greater than any values we examine
-    min_y = datetime.datetime.now().timestamp()
-    for channel in chans:
-        min_y = min(min_y, min(channel.y))
-    return min_y
-
-
-def sync_db(bot):
-    """Write out the current state of the bot db to a persistent file"""
-    with open('db.toml', 'w') as f:
-        f.write('# This file was automatically generated and will be overwritten when settings are updated\n')
-        toml.dump(bot.db, f)
-
-
-def plot_as_attachment():
-    """save image as file-like object and return it as an object ready to be sent in the chat"""
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    return discord.File(buf, filename='channel_activity.png')
-
-
-def interpolate(x, y, steps=5):
-    """Code I stole from SO:
-    https://stackoverflow.com/questions/8500700/how-to-plot-a-gradient-color-line-in-matplotlib/25941474#25941474"""
-    path = mpath.Path(np.column_stack([x, y]))
-    verts = path.interpolated(steps=steps).vertices
-    x, y = verts[:, 0], verts[:, 1]
-    return x, y
-
-
-def postplot_styling(chans):
-    """Configure the graph style, after calling any plotting functions"""
-    # legends and tweaks
-    legend = plt.legend(loc='upper left', prop={'size': 13}, handlelength=0)
-    # set legend labels to the right color
-    for text, chan in zip(legend.get_texts(), chans):
-        text.set_color(cm.get_cmap(chan.colormap)(.5))
-    # get rid of the (usually colored) dots next to the text entries in the legend
-    for item in legend.legendHandles:
-        item.set_visible(False)
-    # grid layout
-    plt.grid(True, 'major', 'x', ls=':', lw=.5, c='w', alpha=.2)
-    plt.grid(True, 'major', 'y', ls=':', lw=.5, c='w', alpha=.2)
-    plt.tight_layout()
-
-
-def preplot_styling(ctx, guild_id):
-    """Configure the graph style (like the legend), before calling the plot functions"""
-    chans = ctx.bot.mydatacache[guild_id][1]
-
-    # Styling
-    fig, ax = plt.subplots()
-    ax.set_ylabel('Messages per hour')
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
-    ax.xaxis.set_major_locator(mdates.WeekdayLocator())
-    ax.set_xlim([datetime.datetime.fromtimestamp(min(chans[0].timestamps)),
-                 datetime.datetime.fromtimestamp(max(chans[0].timestamps))])
-    for pos in ('top', 'bottom', 'left', 'right'):
-        ax.spines[pos].set_visible(False)
-    return chans, fig, ax
+
+import render
+import datacache
+import smoothing
+import message_counts
+
+
+class PngCache:
+    """Rendered graphs, so people spamming a graph command don't make us draw the same thing over and over
+
+    Least recently used graphs get thrown out once there's more than `max_bytes` of them,
+    and graphs older than `max_age` seconds are never handed out.
+    """
+
+    def __init__(self, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = OrderedDict()  # key: (time it was drawn, png bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The png for a key, or None if we don't have a fresh one"""
+        entry = self.entries.get(key)
+        if entry is not None and time.time() - entry[0] > self.max_age:
+            self.pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, png):
+        if key in self.entries:
+            self.pop(key)
+        self.entries[key] = (time.time(), png)
+        self.size += len(png)
+        # throw out the least recently used ones until we fit
+        while self.size > self.max_bytes and self.entries:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        self.size -= len(self.entries.pop(key)[1])
+
+
+def snowflake_seconds(snowflake):
+    """The unix timestamp (in whole seconds) that a discord id was created at.
+    Same as discord.utils.snowflake_time, but without making a datetime object for every message.
+    This works on a whole numpy array of ids at once, too"""
+    return ((snowflake >> 22) + discord.utils.DISCORD_EPOCH) // 1000
+
+
+def seconds_snowflake(timestamp):
+    """The smallest discord id that could be created at a unix timestamp.  The inverse of snowflake_seconds"""
+    return (int(timestamp * 1000) - discord.utils.DISCORD_EPOCH) << 22
+
+
+def bin_timestamps(timestamps, begin, n_bins, width=3600):
+    """Count how many timestamps fall in each of `n_bins` bins that are `width` seconds wide, starting at `begin`
+
+    Timestamps outside of the bins are dropped, rather than raising an IndexError.
+    """
+    t = np.asarray(timestamps, dtype=np.float64)
+    i = np.floor((t - begin) / width).astype(np.int64)
+    i = i[(i >= 0) & (i < n_bins)]
+    return np.bincount(i, minlength=n_bins).astype(np.float64)
+
+
+async def history_ids(channel, after, before=None):
+    """The ids of messages by humans in a channel between two ids (oldest first), and the newest id we saw"""
+    data = array('Q')
+    last_id = after
+    before = None if before is None else discord.Object(id=before)
+    async for msg in channel.history(limit=None, after=discord.Object(id=after), before=before):
+        # bots are left out, same as when counting messages as they come
+        if not msg.author.bot:
+            data.append(msg.id)
+        last_id = max(last_id, msg.id)
+    return data, last_id
+
+
+def plot_as_attachment(png):
+    """Wrap png bytes in an object ready to be sent in the chat"""
+    return discord.File(io.BytesIO(png), filename='channel_activity.png')
+
+
+# graph resolutions people can ask for, in seconds per bin.  Each one has its own table; see message_counts.TABLES
+RESOLUTIONS = {'15m': 900, 'hour': 3600, 'day': 86400}
+YLABELS = {900: 'Messages per 15 minutes', 3600: 'Messages per hour', 86400: 'Messages per day'}
+# (graph function, smoothing) for each graph command
+GRAPHS = {'line': (render.line_graph, 13), 'bar': (render.bar_graph, 0)}
+# graphs asked for in the last REDRAW_FOR seconds get drawn again as each hour is counted, so asking again doesn't have
+# to wait.  Only the MAX_REDRAWN most recent ones, though
+REDRAW_FOR = 24 * 3600
+MAX_REDRAWN = 50
+# the longest window a graph can cover, and the most points it can have, so nobody asks us to crawl or draw forever
+MAX_DAYS = 365
+MAX_BINS = 24 * 4 * 31
+
+
+async def parse_graph_options(ctx, options):
+    """Work out (guild id, days, seconds per bin) from the words after a graph command, in any order
+
+    Small numbers are a number of days, big ones a guild id.  Returns None (after telling them why) if it's nonsense.
+    """
+    guild_id, days, width = None, 30, None
+    for option in options:
+        number = option[:-1] if option.lower().endswith('d') else option
+        if option.lower() in RESOLUTIONS:
+            width = RESOLUTIONS[option.lower()]
+        elif number.isdigit() and int(number) <= MAX_DAYS:
+            days = int(number)
+        elif option.isdigit():
+            guild_id = int(option)
+        else:
+            await ctx.send(f'I don\'t know what `{option}` means.  Try a number of days (up to {MAX_DAYS}), '
+                           f'a resolution ({", ".join(RESOLUTIONS)}), or a guild id')
+            return None
+    if days < 1:
+        await ctx.send('That\'s not much of a graph.  Try at least a day?')
+        return None
+    if width is None:
+        # hourly, unless that would be too many points to see anything
+        width = 3600 if days * 24 <= MAX_BINS else 86400
+    if days * 86400 // width > MAX_BINS:
+        await ctx.send('That\'s too many points for one graph.  Try a coarser resolution, or fewer days')
+        return None
+    guild_id = await get_guild_id(ctx, guild_id)
+    if not guild_id:
+        return None
+    return guild_id, days, width
 
 
 async def get_guild_id(ctx, guild_id):
@@ -109,10 +156,24 @@ async def get_guild_id(ctx, guild_id):
     return None
 
 
-"""Bot data cache has the following structure:
+async def may_change_guild(ctx, guild_id):
+    """Whether the author gets to change what we keep for a guild: their own guild, or any guild for the bot's owner"""
+    if ctx.guild is not None and ctx.guild.id == guild_id or await ctx.bot.is_owner(ctx.author):
+        return True
+    await ctx.send('You can only do that for the guild you\'re in')
+    return False
+
+
+# for commands that change or fetch a lot of what we keep for a guild
+manages_guild = commands.check_any(commands.is_owner(), commands.has_permissions(manage_guild=True))
+
+
+"""Bot data cache is a datacache.DataCache, which works like a dict of
 {
-Guild id : (datetime object of start of era covered, [list of unix timestamps of messages in that channel])
+Guild id : (datetime object of start of era covered, {channel id: datacache.Channel object})
 }
+Channels that have been deleted, or that we can't read, aren't in there.  Excluded ones are, so they're counted just
+the same, and only get left out when graphs are drawn.
 """
 
 
@@ -121,171 +182,647 @@ class Data(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        # Graph styling
-        plt.rcParams['legend.frameon'] = False
-        plt.rcParams['figure.figsize'] = [9, 6]
-        plt.rcParams['savefig.facecolor'] = '#2C2F33'
-        plt.rcParams['axes.facecolor'] = '#2C2F33'
-        plt.rcParams['axes.labelcolor'] = '#999999'
-        plt.rcParams['xtick.color'] = '#999999'
-        plt.rcParams['ytick.color'] = '#999999'
+        # graphs get drawn in other processes, so we don't block the bot while matplotlib works
+        self.renderer = render.Renderer(workers=bot.config.get('render_workers', 2),
+                                        queue_depth=bot.config.get('render_queue_depth', 8))
+        # how many channels' history we fetch at once, so we don't run into discord's rate limits too hard
+        self.history_slots = asyncio.Semaphore(bot.config.get('history_concurrency', 4))
+        # fetching in the background has slots of its own, so it never makes people wait for theirs.  Each fetch holds
+        # its slot for a while after, so there are only `prewarm_per_minute` of them a minute
+        self.background_slots = asyncio.Semaphore(bot.config.get('prewarm_concurrency', 1))
+        per_minute = bot.config.get('prewarm_per_minute', 10)
+        if not per_minute > 0:
+            raise ValueError('prewarm_per_minute in the config has to be more than 0')
+        self.background_pause = 60 / per_minute
+        self.off_peak = set(bot.config.get('prewarm_hours', [4, 5, 6]))
+        if not self.off_peak <= set(range(24)):
+            raise ValueError('prewarm_hours in the config have to be hours of the day, from 0 to 23')
+        # guild id: asyncio.Lock, held while that guild's cache is being updated
+        self.update_locks = dict()
+        # already drawn graphs.  Each guild's data version goes up whenever its past counts or settings change
+        self.png_cache = PngCache(bot.config.get('png_cache_megabytes', 32) * 1024 * 1024,
+                                  bot.config.get('png_cache_seconds', 3600))
+        self.data_versions = dict()
+        # guild id: set of ids of channels left out of graphs there.  Loaded from the settings as they're needed
+        self.excluded_sets = dict()
+        # (guild id, seconds per bin, window length, sigma): (data version, start, end, {channel id: StreamingSmoother})
+        # Least recently used first, and only the last `series_cache_size` of them are kept
+        self.series = OrderedDict()
+        self.series_cache_size = bot.config.get('series_cache_size', 64)
         # message counting
-        self.conn = sqlite3.connect('channel_history.db')
-        self.last_dump_timestamp = -1
-        # message count cache
+        self.conn = message_counts.connect('channel_history.db')
+        message_counts.create_tables(self.conn)
+        # all writes to the db happen in this thread, and get committed every so often
+        self.writer = message_counts.Writer('channel_history.db', bot.config.get('counter_flush_interval', 60))
+        self.migrate_task = self.bot.loop.create_task(self.migrate())
+        # hours that start before this weren't listened to all the way through
+        self.started = time.time()
+        # when we stopped hearing about messages, if we can't right now.  Nothing gets heard until we're connected
+        self.deaf_since = None if bot.is_ready() else self.started
+        # and (start, end) of the times since then that we couldn't.  Hours that overlap them aren't covered
+        self.deaf_times = []
+        # guild id: when we joined it, for guilds joined since the last hour was flushed
+        self.joined = dict()
+        # hours before this have been handed to the writer already
+        self.flushed_until = message_counts.hour_start(self.started)
+        # and hours before this are in the db for sure, so it's safe to graph up to here
+        self.counted_until = self.flushed_until
+        # message count cache, of quarter hour: {(guild id, channel id): count}.  They're added up into hours and days
+        # as they get written
         self.bins = dict()
+        # counts to be added on to the rollup tables, see message_counts.add_rollups
+        self.rollups = dict()
+        self.heatmap = dict()
+        # (guild id, days, seconds per bin, graph name): when someone last asked for it, most recent last
+        self.recent_graphs = OrderedDict()
+        self.redraw_task = None
+        self.rollover_task = self.bot.loop.create_task(self.roll_hours())
+        self.prewarm_task = self.bot.loop.create_task(self.prewarm())
+
+    def cog_unload(self):
+        self.renderer.shutdown()
+        self.migrate_task.cancel()
+        self.rollover_task.cancel()
+        self.prewarm_task.cancel()
+        if self.redraw_task is not None:
+            self.redraw_task.cancel()
+        # save what we've counted so far this hour, so it isn't lost if we're restarting
+        for quarter, bins in self.bins.items():
+            self.writer.submit(message_counts.write_hour, message_counts.hour_start(quarter), {quarter: bins})
+        self.flush_rollups()
+        self.writer.close()
+        self.conn.close()
+
+    async def roll_hours(self):
+        """Background task that hands each hour's message counts over to the writer as soon as the hour is over"""
+        while True:
+            now = time.time()
+            # wait a second past the hour, for messages from the last hour that are slow to get to us
+            await asyncio.sleep(message_counts.hour_start(now) + 3600 + 1 - now)
+            until = message_counts.hour_start(time.time())
+            try:
+                self.flush_hours(until)
+                await self.writer.flush()
+            except Exception as e:
+                # if this task died, counted_until would stop and so would every graph.  Next hour tries again
+                print(f'rolling over the hour failed: {e!r}')
+                continue
+            self.counted_until = until
+            # graphs people have been looking at just went out of date
+            if self.redraw_task is None or self.redraw_task.done():
+                self.redraw_task = self.bot.loop.create_task(self.redraw_recent())
+
+    def flush_hours(self, until):
+        """Give the writer the counts for every hour before `until` that it doesn't have yet
+
+        Every channel we can see gets a row for each hour, even if it's a zero, so that gaps in the db really mean
+        we don't know.
+        """
+        channels = [(guild.id, channel.id) for guild in self.bot.guilds for channel in guild.text_channels]
+        for hour in range(self.flushed_until, until, 3600):
+            quarters = {quarter: self.bins.pop(quarter) for quarter in range(hour, hour + 3600, 900)
+                        if quarter in self.bins}
+            covered = [guild.id for guild in self.bot.guilds if self.joined.get(guild.id, 0) <= hour] \
+                if self.heard_all_of(hour) else []
+            self.writer.submit(message_counts.write_hour, hour, quarters, channels, covered)
+        self.flushed_until = max(self.flushed_until, until)
+        self.deaf_times = [(start, end) for start, end in self.deaf_times if end > self.flushed_until]
+        self.joined = {guild_id: joined for guild_id, joined in self.joined.items() if joined > self.flushed_until}
+        # stragglers for hours we've already handed over just get added on
+        for quarter in [quarter for quarter in self.bins if quarter < self.flushed_until]:
+            self.writer.submit(message_counts.write_hour, message_counts.hour_start(quarter),
+                               {quarter: self.bins.pop(quarter)})
+        self.flush_rollups()
+
+    def heard_all_of(self, hour):
+        """Whether we were hearing about every message for the whole of an hour, so its counts are complete"""
+        end = hour + 3600
+        if hour < self.started or self.deaf_since is not None and self.deaf_since < end:
+            return False
+        return not any(start < end and stop > hour for start, stop in self.deaf_times)
+
+    @commands.Cog.listener()
+    async def on_disconnect(self):
+        if self.deaf_since is None:
+            self.deaf_since = time.time()
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        # discord sends everything we missed when a session is resumed, so nothing was lost
+        self.deaf_since = None
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # but a new session starts fresh, so whatever was said while we were gone was missed
+        if self.deaf_since is not None:
+            self.deaf_times.append((self.deaf_since, time.time()))
+            self.deaf_since = None
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.joined[guild.id] = time.time()
+
+    def flush_rollups(self):
+        """Give the writer everything that's been counted up for the rollup tables"""
+        if self.rollups or self.heatmap:
+            self.writer.submit(message_counts.add_rollups, self.rollups, self.heatmap)
+            self.rollups = dict()
+            self.heatmap = dict()
+
+    async def migrate(self):
+        """Bring anything saved in an old format up to date"""
+        await self.migrate_exclusions()
+        await self.migrate_counts()
+
+    async def migrate_exclusions(self):
+        """Split the old list of excluded channels (from every guild at once) up by guild, if there is one"""
+        old = self.bot.db.get('ACTIVITY', 'excluded_channels')
+        if not old:
+            return
+        guild_ids = set()
+        for chan_id, guild_id in (await self.guilds_of(old)).items():
+            self.excluded(guild_id).add(chan_id)
+            guild_ids.add(guild_id)
+        for guild_id in guild_ids:
+            await self.bot.db.set('EXCLUDED_CHANNELS', str(guild_id), sorted(self.excluded(guild_id)))
+        await self.bot.db.set('ACTIVITY', 'excluded_channels', [])
+        print(f'split up excluded channels for {len(guild_ids)} guilds')
+
+    async def guilds_of(self, chan_ids):
+        """{channel id: guild id} for the channels we can see.  Old formats only had channel ids, so the migrations
+        need this.  It waits until the bot is connected, since we can't see any channels before then"""
+        await self.bot.wait_until_ready()
+        guilds = dict()
+        for chan_id in chan_ids:
+            channel = self.bot.get_channel(chan_id)
+            if channel is not None:
+                guilds[chan_id] = channel.guild.id
+        return guilds
+
+    def excluded(self, guild_id):
+        """The set of ids of channels that are left out of graphs in a guild"""
+        if guild_id not in self.excluded_sets:
+            self.excluded_sets[guild_id] = set(self.bot.db['EXCLUDED_CHANNELS'].get(str(guild_id), []))
+        return self.excluded_sets[guild_id]
+
+    async def migrate_counts(self):
+        """Move message counts from the old table-per-channel layout into one table, if there are any"""
+        old_tables = message_counts.old_channel_tables(self.conn)
+        if not old_tables:
+            return
+        guilds = await self.guilds_of(old_tables)
+        print(f'migrated {await self.writer.run(message_counts.migrate, guilds.get)} channel tables of message counts')
 
     @commands.command(aliases=['exclude'])
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
     async def ignore(self, ctx, channel: discord.TextChannel):
         """
         Exclude a channel from being graphed
 
-        This will clear any caches that the bot has for this guild.
+        Its messages are still counted, so it can be put straight back with unignore.  Needs manage channels.
         """
-        ctx.bot.db['ACTIVITY']['excluded_channels'].append(channel.id)
-        sync_db(ctx.bot)
-        await ctx.invoke(ctx.bot.get_command('clear'), guild_id=ctx.guild.id)
+        excluded = self.excluded(channel.guild.id)
+        if channel.id in excluded:
+            await ctx.send('That\'s already excluded; no need to change :thumbsup:')
+            return
+        excluded.add(channel.id)
+        # graphs get redrawn without it since the exclusions are part of their key
+        await ctx.bot.db.set('EXCLUDED_CHANNELS', str(channel.guild.id), sorted(excluded))
+        await ctx.send(':ok_hand:')
 
     @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
     async def unignore(self, ctx, channel: discord.TextChannel):
         """
         Include a channel from being graphed, if it was excluded before
 
-        This will clear any caches that the bot has for this guild.
+        It shows up in graphs again straight away.  Needs manage channels.
         """
-        if channel.id in ctx.bot.db['ACTIVITY']['excluded_channels']:
-            ctx.bot.db['ACTIVITY']['excluded_channels'].remove(channel.id)
-            sync_db(ctx.bot)
-            await ctx.invoke(ctx.bot.get_command('clear'), guild_id=ctx.guild.id)
+        guild_id = channel.guild.id
+        excluded = self.excluded(guild_id)
+        if channel.id in excluded:
+            excluded.discard(channel.id)
+            await ctx.bot.db.set('EXCLUDED_CHANNELS', str(guild_id), sorted(excluded))
+            # channels used to be left out of the archive while they were excluded, so any that are missing from it
+            # get fetched and backfilled again next time a graph is made
+            if guild_id in ctx.bot.mydatacache and channel.id not in ctx.bot.mydatacache[guild_id][1]:
+                await self.writer.run(message_counts.forget_counts, guild_id, channel.id)
+                self.data_versions[guild_id] = self.data_versions.get(guild_id, 0) + 1
+            await ctx.send(':ok_hand:')
         else:
             await ctx.send('That\'s already included; no need to change :thumbsup:')
 
     @commands.command()
-    async def get_data(self, ctx, guild_id: int = None):
+    @manages_guild
+    async def get_data(self, ctx, guild_id: int = None, days: float = 30):
         """
-        Get the timestamps of all messages by channel, going back a month
+        Archive the ids of all messages by channel, going back a month (and a bit, to a whole hour) by default
 
-        This takes a while.
+        The first time, this takes a while.  After that, only messages sent since last time are fetched, plus older
+        ones if you ask for more days than we've gone back before.  It goes back at most as far as the longest graph.
         """
         guild_id = await get_guild_id(ctx, guild_id)
-        if not guild_id:
+        if not guild_id or not await may_change_guild(ctx, guild_id):
             return
+        # the longest graph ends on a whole day, so can start a day or two more than MAX_DAYS ago.  (nan ends up as 1)
+        days = min(days, MAX_DAYS + 2) if days >= 1 else 1
+        await self.update_cache_showing_progress(ctx, ctx.bot.get_guild(guild_id), days)
+
+    async def update_cache_showing_progress(self, ctx, guild, days):
+        """update_cache, with a loading message in the chat that says how far it's got"""
         print('populating cache...')
-        load_msg = None
+        emoji = '<' + ctx.bot.config['loadingemoji'] + '>'
+        load_msg = await ctx.send(emoji)
+        progress = [0, 0]  # channels done, channels total
+
+        async def show_progress():
+            """Edit the loading message every so often, rather than on every channel, to go easy on the api"""
+            shown = None
+            while True:
+                if progress[1] and progress != shown:
+                    shown = list(progress)
+                    await load_msg.edit(content=f'{emoji} fetching history: {shown[0]}/{shown[1]} channels')
+                await asyncio.sleep(2)
+
+        progress_task = ctx.bot.loop.create_task(show_progress())
         try:
-            await ctx.message.add_reaction(ctx.bot.config['loadingemoji'])
-        except discord.errors.Forbidden:  # if we don't have react perms, send a message instead
-            load_msg = await ctx.send('<' + ctx.bot.config['loadingemoji'] + '>')
-
-        now = datetime.datetime.now()
-        begin = now - datetime.timedelta(days=30)
-        # cache is a list of Channel objects, as defined above
-        cache = []
-        for channel in ctx.bot.get_guild(guild_id).text_channels:
-            if channel.id not in ctx.bot.db['ACTIVITY']['excluded_channels']:
-                data = []
-                try:
-                    async for msg in channel.history(limit=None, after=begin):
-                        data.append(discord.utils.snowflake_time(msg.id).timestamp())
-                except discord.errors.Forbidden:
-                    pass  # silently ignore channels we don't have perms to read
-                else:
-                    if len(data) > 0:
-                        cache.append(Channel(channel.name, data))
-        # sort by most total messages first
-        cache = sorted(cache, key=lambda c: len(c.timestamps), reverse=True)
-        # discard channels with little activity (also we only have so many colormaps)
-        colormap_count = len(ctx.bot.config['colormaps'])
-        if len(cache) > colormap_count:
-            cache = cache[:colormap_count]
-
-        ctx.bot.mydatacache[guild_id] = (begin, cache)
-        print("done")
-        if load_msg:
+            await self.update_cache(guild, days, progress)
+        finally:
+            progress_task.cancel()
             await load_msg.delete()
-        else:
-            await ctx.message.remove_reaction(ctx.bot.config['loadingemoji'], ctx.me)
+        print("done")
+
+    async def update_cache(self, guild, days=30, progress=None, background=False):
+        """Bring the archived message ids for a guild up to date, going back at least `days` days
+
+        Channels are fetched a few at a time.  If `progress` is given, it's kept updated as [channels done, total].
+        `background` fetches are for when nobody is waiting, and go slower so they don't get in anyone's way.
+        """
+        # one update per guild at a time, so two graph requests don't both fetch (and add) the same messages
+        async with self.update_locks.setdefault(guild.id, asyncio.Lock()):
+            now = datetime.datetime.now()
+            begin = datetime.datetime.fromtimestamp(message_counts.hour_start(now.timestamp() - days * 24 * 3600))
+            old_begin, chans = self.bot.mydatacache.get(guild.id, (None, dict()))
+            # the archive only ever grows, so we never go back less far than before
+            if old_begin is not None:
+                begin = min(begin, old_begin)
+            # forget channels that have been deleted since last time.  Excluded channels are fetched like the rest,
+            # since their counts are kept for if they're ever included again
+            text_channels = guild.text_channels
+            current_ids = {channel.id for channel in text_channels}
+            chans = {chan_id: chan for chan_id, chan in chans.items() if chan_id in current_ids}
+            if progress is not None:
+                progress[:] = [0, len(text_channels)]
+            # every fetch gets to finish, even if one fails, so none of them are still adding to channels once the
+            # lock is let go
+            results = await asyncio.gather(*(self.fetch_channel(channel, chans, begin, old_begin, now, progress,
+                                                                background)
+                                             for channel in text_channels), return_exceptions=True)
+            failed = [error for error in results if isinstance(error, BaseException)]
+            if old_begin is not None and begin < old_begin:
+                # channels that failed didn't get their older history, so they start over next time
+                for channel, result in zip(text_channels, results):
+                    if isinstance(result, BaseException):
+                        chans.pop(channel.id, None)
+            self.bot.mydatacache[guild.id] = (begin, chans)
+            # so a restart doesn't have to fetch all of it again
+            await self.bot.mydatacache.save(guild.id)
+            if failed:
+                raise failed[0]
+
+    async def fetch_channel(self, channel, chans, begin, old_begin, now, progress, background=False):
+        """Add messages sent in a channel since we last looked to its entry in `chans`, making it if needed
+
+        If history now starts further back than `old_begin`, where it used to start, older messages get added too.
+        They're written to the channel's archive when the guild gets saved.
+        """
+        async with self.background_slots if background else self.history_slots:
+            chan = chans.get(channel.id)
+            older = array('Q')
+            try:
+                if chan is None:
+                    # go back the whole way if we've never seen this channel
+                    data, last_id = await history_ids(channel, seconds_snowflake(begin.timestamp()))
+                else:
+                    # pick up where we left off
+                    data, last_id = await history_ids(channel, chan.last_id)
+                    if begin < old_begin:
+                        older, _ = await history_ids(channel, seconds_snowflake(begin.timestamp()),
+                                                     seconds_snowflake(old_begin.timestamp()))
+            except discord.errors.Forbidden:
+                pass  # silently ignore channels we don't have perms to read
+            else:
+                # if nothing new turns up, next time we can start from now
+                last_id = max(last_id, seconds_snowflake(now.timestamp()))
+                if chan is None:
+                    archive = self.bot.mydatacache.archive(channel.guild.id, channel.id)
+                    archive.remove()  # anything left over from before it was cleared would get counted twice
+                    chans[channel.id] = chan = datacache.Channel(channel.name, last_id, archive)
+                else:
+                    chan.name = channel.name
+                    chan.last_id = last_id
+                chan.old[:0] = older
+                chan.new.extend(data)
+            if progress is not None:
+                progress[0] += 1
+            if background:
+                await asyncio.sleep(self.background_pause)
 
     @commands.command()
-    async def clear(self, ctx, guild_id: int = None):
-        """Ensure next time we graph, we'll go through channels again to get data, rather than using a cached version"""
-        guild_id = await get_guild_id(ctx, guild_id)
-        if not guild_id:
+    @manages_guild
+    async def clear(self, ctx, channel: typing.Optional[discord.TextChannel] = None, guild_id: int = None):
+        """Throw away the message counts and history we have for a channel, so they're fetched again from scratch
+
+        If no channel is given, this forgets everything about the guild.  Useful if the counts have gone wrong.
+        """
+        if channel is not None:
+            guild_id = channel.guild.id
+        else:
+            guild_id = await get_guild_id(ctx, guild_id)
+        if not guild_id or not await may_change_guild(ctx, guild_id):
             return
-        if guild_id in ctx.bot.mydatacache:
-            ctx.bot.mydatacache.pop(guild_id)
+        # not while the guild's history is being fetched, or that would carry on with what we're throwing away
+        async with self.update_locks.setdefault(guild_id, asyncio.Lock()):
+            # the next graph finds the hours aren't covered anymore, and fetches history again to backfill them
+            await self.writer.run(message_counts.forget_counts, guild_id, channel and channel.id)
+            self.data_versions[guild_id] = self.data_versions.get(guild_id, 0) + 1
+            if channel is not None:
+                if guild_id in ctx.bot.mydatacache:
+                    ctx.bot.mydatacache[guild_id][1].pop(channel.id, None)
+                    await ctx.bot.mydatacache.save(guild_id)
+            elif guild_id in ctx.bot.mydatacache:
+                await ctx.bot.mydatacache.pop(guild_id)
         await ctx.send(":ok_hand:")
 
+    @commands.command(aliases=['memory'])
+    @commands.is_owner()
+    async def cache_size(self, ctx):
+        """Show how much disk the message history archive takes up for each guild that's been loaded"""
+        sizes = []
+        for guild_id, (begin, chans) in ctx.bot.mydatacache.items():
+            guild = ctx.bot.get_guild(guild_id)
+            name = guild.name if guild else str(guild_id)
+            chans = chans.values()
+            sizes.append((sum(chan.size() for chan in chans), sum(len(chan) for chan in chans), name))
+        if not sizes:
+            await ctx.send('The cache is empty')
+            return
+        sizes.sort(reverse=True)
+        # only the biggest ones, so we stay under discord's message length limit
+        s = "\n".join(f'{size / 1024:>10.1f} KiB {count:>9} msgs  {name}' for size, count, name in sizes[:20])
+        s += f'\n{sum(size for size, _, _ in sizes) / 1024:>10.1f} KiB total'
+        await ctx.send(f'```\n{s}```')
+
     @commands.command(aliases=['magic', 'line'])
-    async def pretty_graph(self, ctx, guild_id: int = None):
-        """Create a smooth line graph of messages per hour for popular channels"""
-        guild_id = await get_guild_id(ctx, guild_id)
-        if not guild_id:
+    async def pretty_graph(self, ctx, *options):
+        """Create a smooth line graph of messages over time for popular channels
+
+        Options go in any order: how many days to show (30 by default), a resolution of 15m, hour or day (hourly by
+        default, or daily if that's too many points), and a guild id.  For example, `line 7 15m`
+        """
+        await self.send_graph(ctx, options, 'line')
+
+    @commands.command(aliases=['bar'])
+    async def rawer_graph(self, ctx, *options):
+        """Create a bar chart of messages over time for popular channels
+
+        Takes the same options as the line graph.
+        """
+        await self.send_graph(ctx, options, 'bar')
+
+    async def send_graph(self, ctx, options, name):
+        """Work out what graph they asked for, and send it, drawing it first if we don't have it already"""
+        options = await parse_graph_options(ctx, options)
+        if options is None:
+            return
+        guild_id, days, width = options
+        guild = ctx.bot.get_guild(guild_id)
+        start, end = self.graph_window(days, width)
+        await self.fill_gaps(guild, start, end, ctx)
+        key = (guild_id, days, width, name)
+        self.recent_graphs[key] = time.time()
+        self.recent_graphs.move_to_end(key)
+        while len(self.recent_graphs) > MAX_REDRAWN:
+            self.recent_graphs.popitem(last=False)
+        try:
+            png = await self.draw_graph(guild, start, end, width, *GRAPHS[name])
+        except render.QueueFull:
+            await ctx.send('I\'m drawing too many graphs right now.  Try again in a bit?')
             return
+        if png is None:
+            await ctx.send(f'Nobody has said anything here in the last {days} days, so there\'s nothing to graph')
+            return
+        await ctx.send(file=plot_as_attachment(png))
+
+    def graph_window(self, days, width):
+        """The (start, end) of a graph going back `days` days, in whole bins that have been counted all the way"""
+        end = self.counted_until // width * width
+        return end - days * 24 * 3600, end
 
-        if guild_id not in ctx.bot.mydatacache:
-            await ctx.invoke(ctx.bot.get_command('get_data'), guild_id=guild_id)
+    async def fill_gaps(self, guild, start, end, ctx=None, background=False):
+        """Make sure we have counts for every hour in [start, end), fetching message history for any we don't
+
+        If there's a `ctx`, they get to see how the fetching is going.  Returns whether anything had to be fetched.
+        `background` is passed on to update_cache.
+        """
+        covered = message_counts.covered_hours(self.conn, guild.id, start, end)
+        missing = [hour for hour in range(start, end, 3600) if hour not in covered]
+        if not missing:
+            return False
+        # This only fetches what's new if we've looked at this guild before.
+        # The cache never gets shorter than a month from here, so short graphs don't make long ones crawl again
+        days_needed = max(30, (time.time() - missing[0]) / (24 * 3600))
+        if ctx is None:
+            await self.update_cache(guild, days_needed, background=background)
         else:
-            print('cache is already filled')
-
-        chans, fig, ax = preplot_styling(ctx, guild_id)
-        bins = np.linspace(min(chans[0].timestamps), max(chans[0].timestamps), int(24 * 30.5))  # leave some fudge space
-        # first pass through data, to get smoothed values to plot
-        for chan, cmap in zip(chans, ctx.bot.config['colormaps']):
-            y = self.get_y(chan, bins, guild_id)
-            chan.y = y
-            chan.colormap = cmap
-        # we need this so that colormaps for each series stretch to the global max, rather than the max of that series
-        global_max = get_max(chans)
-        # second pass through data, doing interpolation and actually plotting
-        for channel in chans:
-            # we graph a scatter plot not a line plot, so need to make enough points that it looks continuous
-            x, y = interpolate(bins, channel.y)
-            # stretch the colormap; we don't use extremes cuz they ugly
-            norm = colors.Normalize(vmin=-global_max / 1.5, vmax=global_max * 2.5)
-            # boring conversions.  Prob a better way to do this but whatevs
-            x = [datetime.datetime.fromtimestamp(t) for t in x]
-            plt.scatter(x, y, label=channel.name, c=y, s=10, cmap=channel.colormap, norm=norm)
-
-        postplot_styling(chans)
-        await ctx.send(file=plot_as_attachment())
+            await self.update_cache_showing_progress(ctx, guild, days_needed)
+        await self.backfill(guild.id, missing)
+        return True
 
-    @commands.command(aliases=['bar'])
-    async def rawer_graph(self, ctx, guild_id: int = None):
-        """Create a bar chart of messages per hour for popular channels"""
+    async def draw_graph(self, guild, start, end, width, graph_func, smoothing):
+        """Get the binned message counts for a guild, and have the renderer draw them with a function in render.py
+
+        `smoothing` is the sigma (in hours) that looks right for a month of hourly bins.  Other windows and resolutions
+        get it scaled to match, so graphs look about as smooth whatever you ask for.
+        Returns the png bytes, or None if there's nothing to graph.  Raises render.QueueFull if the renderer is busy.
+        """
+        # nothing changes until the next hour is over, unless something gets backfilled or settings change
+        excluded = self.excluded(guild.id)
+        key = (guild.id, graph_func.__name__, width, start, end, tuple(self.bot.config['colormaps']),
+               self.data_versions.get(guild.id), frozenset(excluded))
+        png = self.png_cache.get(key)
+        if png is not None:
+            return png
+
+        channels = {channel.id: channel for channel in guild.text_channels if channel.id not in excluded}
+        sigma = round(smoothing * 3600 / width * (end - start) / (30 * 24 * 3600))
+        smoothers = self.binned_series(guild.id, start, end, width, sigma)
+        # sort by most total messages first
+        totals = {chan_id: s.raw.sum() for chan_id, s in smoothers.items() if chan_id in channels}
+        top = sorted((chan_id for chan_id in totals if totals[chan_id] > 0), key=totals.get, reverse=True)
+        # discard channels with little activity (also we only have so many colormaps)
+        top = top[:len(self.bot.config['colormaps'])]
+        if not top:
+            return None
+        # only plain data goes to the renderer: (channel name, y values, colormap name) for each channel
+        series = [(channels[chan_id].name, smoothers[chan_id].smoothed, cmap)
+                  for chan_id, cmap in zip(top, self.bot.config['colormaps'])]
+        png = await self.renderer.render(graph_func, np.arange(start, end, width), series, YLABELS[width])
+        self.png_cache.put(key, png)
+        return png
+
+    async def prewarm(self):
+        """Background task that fills in the last month's counts for every guild before anyone asks for a graph
+
+        It goes once when the bot starts, since that's when there's a gap to fill in, and then every off-peak hour
+        from the config.  Its fetches are background ones (see update_cache), so people asking for graphs still get
+        the api when they need them.  Graphs aren't drawn ahead of time here, since they'd be out of date within the
+        hour; see redraw_recent for that.
+        """
+        await self.bot.wait_until_ready()
+        while True:
+            for guild in list(self.bot.guilds):
+                try:
+                    start, end = self.graph_window(30, 3600)
+                    await self.fill_gaps(guild, start, end, background=True)
+                except Exception as e:
+                    # one guild going wrong shouldn't stop the rest getting done
+                    print(f'prewarming {guild.name} failed: {e!r}')
+            if not self.off_peak:
+                return
+            # sleep until the next off-peak hour, and a bit longer so the hour before it is counted
+            now = time.time()
+            hour = message_counts.hour_start(now) + 3600
+            while hour // 3600 % 24 not in self.off_peak:
+                hour += 3600
+            await asyncio.sleep(hour + 60 - now)
+
+    async def redraw_recent(self):
+        """Draw the graphs people asked for lately again, now that there's another hour in them
+
+        Then asking for the same graph again is a cache hit.  It only draws `prewarm_per_minute` graphs a minute, and
+        fetches in the background like prewarming.
+        """
+        cutoff = time.time() - REDRAW_FOR
+        for key, asked in list(self.recent_graphs.items()):
+            if asked < cutoff:
+                self.recent_graphs.pop(key, None)
+                continue
+            guild_id, days, width, name = key
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            start, end = self.graph_window(days, width)
+            try:
+                await self.fill_gaps(guild, start, end, background=True)
+                await self.draw_graph(guild, start, end, width, *GRAPHS[name])
+            except render.QueueFull:
+                pass  # people are waiting on graphs right now, and they come first
+            except Exception as e:
+                print(f'redrawing a graph for {guild.name} failed: {e!r}')
+            await asyncio.sleep(self.background_pause)
+
+    def binned_series(self, guild_id, start, end, width, sigma):
+        """The message counts in [start, end) for each channel in a guild, in bins `width` seconds wide, smoothed
+
+        Returns a dict of channel id: smoothing.StreamingSmoother, for channels with any messages in the window.  If we
+        did the same guild and window before, and only time has moved on since, just the new bins are read from the db
+        and smoothed.
+        """
+        version = self.data_versions.get(guild_id)
+        n_bins = (end - start) // width
+        cache_key = (guild_id, width, end - start, sigma)
+        cached = self.series.get(cache_key)
+        n_new = None  # how many bins the window has slid forward since last time
+        if cached is not None and cached[0] == version:
+            n_new = (end - cached[2]) // width
+
+        if n_new is None or not 0 <= n_new < n_bins:
+            smoothers = {chan_id: smoothing.StreamingSmoother(y, sigma)
+                         for chan_id, y in message_counts.read_counts(self.conn, guild_id, start, end, width).items()
+                         if y.any()}
+        else:
+            smoothers = cached[3]
+            if n_new:
+                new = message_counts.read_counts(self.conn, guild_id, cached[2], end, width)
+                for chan_id, smoother in smoothers.items():
+                    smoother.append(new.pop(chan_id, np.zeros(n_new)))
+                    smoother.drop(n_new)
+                # channels that didn't have anything before
+                for chan_id, y in new.items():
+                    if y.any():
+                        smoothers[chan_id] = smoothing.StreamingSmoother(
+                            np.concatenate([np.zeros(n_bins - n_new), y]), sigma)
+                # and ones that have gone quiet for the whole window
+                for chan_id in [chan_id for chan_id, smoother in smoothers.items() if not smoother.raw.any()]:
+                    del smoothers[chan_id]
+        self.series[cache_key] = (version, start, end, smoothers)
+        self.series.move_to_end(cache_key)
+        while len(self.series) > self.series_cache_size:
+            self.series.popitem(last=False)
+        return smoothers
+
+    async def backfill(self, guild_id, hours):
+        """Count up messages from the cache for hours we don't have counts for, and save them in the db
+
+        They're counted by the quarter hour, and the db adds those up into hours and days.
+        """
+        _, chans = self.bot.mydatacache[guild_id]
+        first = hours[0]
+        n_quarters = (hours[-1] + 3600 - first) // 900
+        i = [(hour - first) // 900 + quarter for hour in hours for quarter in range(4)]
+        # straight from views of the archives, so only the blocks with these hours in them get read off the disk
+        start, end = seconds_snowflake(first), seconds_snowflake(hours[-1] + 3600)
+        counts = {chan_id: bin_timestamps(snowflake_seconds(chan.between(start, end)), first, n_quarters, 900)[i]
+                  for chan_id, chan in chans.items()}
+        await self.writer.run(message_counts.write_backfill, guild_id, hours, counts)
+        self.data_versions[guild_id] = self.data_versions.get(guild_id, 0) + 1
+
+    @commands.command(aliases=['top'])
+    async def top_posters(self, ctx, guild_id: int = None):
+        """Show who has sent the most messages in the last month"""
         guild_id = await get_guild_id(ctx, guild_id)
         if not guild_id:
             return
-        if guild_id not in ctx.bot.mydatacache:
-            await ctx.invoke(ctx.bot.get_command('get_data'), guild_id=guild_id)
-        else:
-            print('cache is already filled')
-
-        chans, fig, ax = preplot_styling(ctx, guild_id)
-        bins = np.linspace(min(chans[0].timestamps), max(chans[0].timestamps), int(24 * 30.5))  # leave some fudge space
-        # first pass through data, to get smoothed values to plot
-        for chan, cmap in zip(chans, ctx.bot.config['colormaps']):
-            y = self.get_y(chan, bins, guild_id, smoothing=0)
-            chan.y = y
-            chan.colormap = cmap
-        # second pass through data, doing interpolation and actually plotting
-        for channel in chans:
-            # boring conversions.  Prob a better way to do this but whatevs
-            x = [datetime.datetime.fromtimestamp(t) for t in bins]
-            plt.bar(x, channel.y, .1, label=channel.name, alpha=.3, color=cm.get_cmap(channel.colormap)(.5), )
-
-        postplot_styling(chans)
-        await ctx.send(file=plot_as_attachment())
-
-    def get_y(self, channel, bins, guild_id, smoothing=13):
-        """For data on a channel, return the smoothed, binned y values to be interpolated and graphed"""
-        y = np.zeros(len(bins))
-        begin = self.bot.mydatacache[guild_id][0].timestamp()
-        for msg_time in channel.timestamps:
-            y[int((msg_time - begin) / 3600)] += 1  # change me
-        if smoothing > 1:
-            return gaussian_filter1d(y, sigma=smoothing)
-        return y
+        guild = ctx.bot.get_guild(guild_id)
+        start = message_counts.day_start(time.time()) - 30 * 86400
+        top = message_counts.read_top(self.conn, guild_id, 'author', 'day', start)
+        if not top:
+            await ctx.send('I haven\'t seen anyone say anything here yet')
+            return
+        lines = []
+        for author_id, n in top:
+            member = guild.get_member(author_id)
+            # no mentions, so we don't ping everyone on the list
+            lines.append(f'{n:>7}  {member.display_name if member else author_id}')
+        await ctx.send('Most messages in the last month:\n```\n' + '\n'.join(lines) + '```')
+
+    @commands.command()
+    async def busiest(self, ctx, guild_id: int = None):
+        """Show which hours of the week are usually the busiest"""
+        guild_id = await get_guild_id(ctx, guild_id)
+        if not guild_id:
+            return
+        counts = message_counts.read_hour_of_week(self.conn, guild_id)
+        if not counts.any():
+            await ctx.send('I haven\'t seen anyone say anything here yet')
+            return
+        days = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+        lines = [f'{days[hour // 24]:>9} {hour % 24:02}:00  {int(counts[hour]):>7}'
+                 for hour in np.argsort(counts)[::-1][:5] if counts[hour] > 0]
+        await ctx.send('Busiest hours of the week (utc):\n```\n' + '\n'.join(lines) + '```')
+
+    @commands.command()
+    @commands.is_owner()
+    async def png_cache_stats(self, ctx):
+        """Show how well the cache of drawn graphs is doing"""
+        c = self.png_cache
+        total = c.hits + c.misses
+        rate = c.hits / total if total else 0
+        await ctx.send(f'```\nhits: {c.hits}\nmisses: {c.misses} ({rate:.0%} hit rate)\n'
+                       f'graphs cached: {len(c.entries)} ({c.size / 1024:.1f} KiB)```')
 
     @commands.command()
     @commands.is_owner()
@@ -303,37 +840,30 @@ class Data(commands.Cog):
     @commands.command(hidden=True)
     async def bins(self, ctx):
         """Print out all the bins, for debugging"""
-        s = "\n".join('{}: {}'.format(k, self.bins[k]) for k in self.bins)
-        await ctx.send(f'```json\n{s}```')
+        s = "\n".join('{} {}: {}'.format(hour, k, bins[k]) for hour, bins in self.bins.items() for k in bins)
+        await ctx.send(f'```json\n{s[:1980]}```')
 
     @commands.Cog.listener()
     async def on_message(self, msg):
-        """Keep track of message count as messages come, by channel"""
-        # get the timestamp of the beginning of this hour
-        d = datetime.datetime.utcnow()
-        last_hour = d - datetime.timedelta(minutes=d.minute, seconds=d.second, microseconds=d.microsecond)
-        timestamp = int(last_hour.timestamp())
-
-        # if message is in a new hour than recently recorded, dump all contents of self.bins into db and clear it
-        if timestamp != self.last_dump_timestamp:
-            print(f'dumping!  timestamp is {timestamp}')
-            self.last_dump_timestamp = timestamp
-            c = self.conn.cursor()
-            for chan_id in self.bins:
-                # make sure table exists
-                c.execute(f'create table if not exists \'{chan_id}\' (timestamp INTEGER, count INTEGER)')
-                # dump latest data into the table
-                c.execute(f'insert into \'{chan_id}\' values (?, ?)', (timestamp, self.bins[chan_id]))
-            # flush memory changes to disk
-            self.conn.commit()
-            # empty our cache thingy
-            self.bins = dict()
-
-        # add to memory bin
-        if not msg.author.bot:
-            if msg.channel.id not in self.bins:
-                self.bins[msg.channel.id] = 0
-            self.bins[msg.channel.id] += 1
+        """Keep track of message count as messages come, by channel and by the quarter hour they were sent in"""
+        # add to memory bin.  roll_hours takes care of moving it to the db
+        if not msg.author.bot and msg.guild is not None:
+            sent = snowflake_seconds(msg.id)
+            bins = self.bins.setdefault(message_counts.quarter_start(sent), dict())
+            key = (msg.guild.id, msg.channel.id)
+            if key not in bins:
+                bins[key] = 0
+            bins[key] += 1
+
+            # and keep the rollups up to date too
+            guild_id = msg.guild.id
+            periods = (('day', message_counts.day_start(sent)), ('week', message_counts.week_start(sent)))
+            for period, period_ts in periods:
+                for kind, key_id in (('channel', msg.channel.id), ('guild', guild_id), ('author', msg.author.id)):
+                    key = (guild_id, kind, period, period_ts, key_id)
+                    self.rollups[key] = self.rollups.get(key, 0) + 1
+            key = (guild_id, message_counts.hour_of_week(sent))
+            self.heatmap[key] = self.heatmap.get(key, 0) + 1
 
 
 def setup(bot):
@@ -0,0 +1,137 @@
+"""The cache of message history that graphs get filled in from, kept on disk so restarts don't mean crawling again
+
+Each guild gets a folder under the cache's path, with an index.json of when the history we have begins and each
+channel's name and newest message id, and an archive (see archive.py) of each channel's message ids.  Archives only
+ever grow, so there's history for as far back as anyone has graphed.  Guilds are only read in the first time they're
+asked for, and message ids never have to be in memory except while they're being fetched or counted.
+"""
+import os
+import json
+import shutil
+import asyncio
+import datetime
+from array import array
+
+import numpy as np
+
+from archive import Archive, write_atomic
+
+
+class Channel:
+    """Data struct for the things I care about in a channel"""
+    __slots__ = ('name', 'last_id', 'archive', 'new', 'old')
+
+    def __init__(self, name, last_id, archive):
+        self.name = name
+        # id of the newest message we've seen, so next time we only need to fetch messages after it
+        self.last_id = last_id
+        # ids of all messages sent by humans in the channel that we've fetched, oldest first
+        self.archive = archive
+        # ids that have been fetched but not written to the archive yet: newer than it, and older than it
+        self.new = array('Q')
+        self.old = array('Q')
+
+    def between(self, start, end):
+        """A numpy view of the archived ids in [start, end)"""
+        return self.archive.between(start, end)
+
+    def __len__(self):
+        return len(self.archive) + len(self.new) + len(self.old)
+
+    def size(self):
+        """How many bytes the channel's archive takes up on disk"""
+        return len(self) * 8
+
+
+class DataCache:
+    """Guild id: (datetime of the start of the era covered, {channel id: Channel}), backed by files under `path`
+
+    Channels that have been deleted, or that we can't read, aren't in there.  Only guilds that have been asked for
+    since the bot started are loaded; `items` only goes over those.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.guilds = dict()
+        # guild id: asyncio.Lock, so a guild's files are only written by one save (or pop) at a time, in order
+        self.locks = dict()
+
+    def guild_path(self, guild_id):
+        return os.path.join(self.path, str(guild_id))
+
+    def archive(self, guild_id, chan_id):
+        return Archive(os.path.join(self.guild_path(guild_id), f'{chan_id}.ids'))
+
+    def load(self, guild_id):
+        """Read a guild's index in from disk, if it's there and we haven't already"""
+        if guild_id in self.guilds:
+            return
+        try:
+            with open(os.path.join(self.guild_path(guild_id), 'index.json')) as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        chans = dict()
+        for chan_id, (name, last_id) in index['channels'].items():
+            archive = self.archive(guild_id, chan_id)
+            # channels saved before there were archives just get fetched again
+            if os.path.exists(archive.path):
+                chans[int(chan_id)] = Channel(name, last_id, archive)
+        self.guilds[guild_id] = (datetime.datetime.fromtimestamp(index['begin']), chans)
+
+    def get(self, guild_id, default=None):
+        self.load(guild_id)
+        return self.guilds.get(guild_id, default)
+
+    def __getitem__(self, guild_id):
+        self.load(guild_id)
+        return self.guilds[guild_id]
+
+    def __contains__(self, guild_id):
+        self.load(guild_id)
+        return guild_id in self.guilds
+
+    def __setitem__(self, guild_id, value):
+        self.guilds[guild_id] = value
+
+    def items(self):
+        return self.guilds.items()
+
+    async def pop(self, guild_id, default=None):
+        """Forget a guild, on disk too.  The files are deleted in another thread, since there can be a lot of them"""
+        guild = self.guilds.pop(guild_id, default)
+        async with self.locks.setdefault(guild_id, asyncio.Lock()):
+            await asyncio.get_event_loop().run_in_executor(None, shutil.rmtree, self.guild_path(guild_id), True)
+        return guild
+
+    async def save(self, guild_id):
+        """Write a guild's newly fetched ids and its index out to disk, in another thread so the bot doesn't wait"""
+        # ids are taken from the channels once the last save is done with the files, so they're written in order
+        async with self.locks.setdefault(guild_id, asyncio.Lock()):
+            if guild_id not in self.guilds:
+                return
+            begin, chans = self.guilds[guild_id]
+            index = {'begin': begin.timestamp(),
+                     'channels': {str(chan_id): [chan.name, chan.last_id] for chan_id, chan in chans.items()}}
+            # take what's waiting now, since the channels can get more while the other thread writes
+            pending = []
+            for chan in chans.values():
+                pending.append((chan.archive, np.frombuffer(chan.old, np.uint64).copy(),
+                                np.frombuffer(chan.new, np.uint64).copy()))
+                chan.old = array('Q')
+                chan.new = array('Q')
+            await asyncio.get_event_loop().run_in_executor(None, self.write, guild_id, index, pending)
+
+    def write(self, guild_id, index, pending):
+        path = self.guild_path(guild_id)
+        os.makedirs(path, exist_ok=True)
+        for archive, old, new in pending:
+            # make the file even if there's nothing in it, so we know the channel's been fetched
+            open(archive.path, 'ab').close()
+            archive.prepend(old)
+            archive.append(new)
+        write_atomic(os.path.join(path, 'index.json'), json.dumps(index).encode())
+        # and get rid of channels that aren't in the cache anymore (and the arrays we used to keep before archives)
+        for name in os.listdir(path):
+            if name.endswith('.npy') or name != 'index.json' and name.split('.')[0] not in index['channels']:
+                os.remove(os.path.join(path, name))
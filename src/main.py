@@ -1,4 +1,3 @@
-import json
 import os
 import random
 import subprocess
@@ -7,47 +6,36 @@ import discord
 import toml
 from discord.ext import commands
 
+import datacache
+import settings
 
-def write_db():
-    """Write out a db file with default settings"""
-    print('Didn\'t find a db file, so creating a new one with default settings')
-    data = {'ACTIVITY': {
-        'excluded_channels': []
-    }, 'CHANNEL_REARRANGING': {
-        'log_channels': {
-            325354209673216010: 325354209673216010,
-            391743485616717824: 568975675252408330
-        }
-    }, 'ALARM': {
-        'err_channels': {
-            325354209673216010: 325354209673216010,
-            391743485616717824: 568975675252408330
-        }
-    }, 'APOD':  {
-        'channel': {
-            325354209673216010: 325354209673216010,
-            391743485616717824: 395649976048287758
-        }
-    }, 'REACTION': {
-        'max_age': 3,  # days
-        'log_channels': {
-            325354209673216010: 325354209673216010,
-            391743485616717824: 568975675252408330
-        }
+
+# settings for a brand new bot, if there's no db.json to import them from
+DEFAULT_SETTINGS = {'EXCLUDED_CHANNELS': {
+    # str(guild id): list of ids of channels that aren't graphed there
+}, 'CHANNEL_REARRANGING': {
+    'log_channels': {
+        325354209673216010: 325354209673216010,
+        391743485616717824: 568975675252408330
     }
+}, 'ALARM': {
+    'err_channels': {
+        325354209673216010: 325354209673216010,
+        391743485616717824: 568975675252408330
     }
-    with open("db.json", "w") as f:
-        json.dump(data, f)
-    return data
-
-
-def get_db():
-    """Get the persistent settings for the bot. You shouldn't need to worry about this"""
-    try:
-        with open('db.json') as f:
-            return json.load(f)
-    except:
-        return write_db()
+}, 'APOD':  {
+    'channel': {
+        325354209673216010: 325354209673216010,
+        391743485616717824: 395649976048287758
+    }
+}, 'REACTION': {
+    'max_age': 3,  # days
+    'log_channels': {
+        325354209673216010: 325354209673216010,
+        391743485616717824: 568975675252408330
+    }
+}
+}
 
 
 def prep():
@@ -76,8 +64,6 @@ def prep():
         return config
 
 
-config = prep()
-bot = commands.Bot(command_prefix=config['prefix'])
 disses = ('Eat moon dirt, kid, I ain\'t talkin to you',
           'Nah fam go do something useful with your life instead of tryin to break someone else\'s bot.',
           'Frick off kid, I do what I want',
@@ -87,34 +73,34 @@ disses = ('Eat moon dirt, kid, I ain\'t talkin to you',
 
 
 @commands.cooldown(rate=1, per=7)
-@bot.command(hidden=True)
+@commands.command(hidden=True)
 async def murder(ctx):
     """Make bot logout."""
-    if await bot.is_owner(ctx.message.author):
+    if await ctx.bot.is_owner(ctx.message.author):
         await ctx.send('Thus, with a kiss, I die')
-        await bot.logout()
+        await ctx.bot.logout()
     else:
         await ctx.send(random.choice(disses))
 
 
 @commands.cooldown(rate=7, per=30)
-@bot.command(hidden=True)
+@commands.command(hidden=True)
 async def unload(ctx, extension_name: str):
     """Unloads an extension."""
-    if await bot.is_owner(ctx.message.author):
-        bot.unload_extension(extension_name)
+    if await ctx.bot.is_owner(ctx.message.author):
+        ctx.bot.unload_extension(extension_name)
         await ctx.send('{} unloaded.'.format(extension_name))
     else:
         await ctx.send(random.choice(disses))
 
 
 @commands.cooldown(rate=7, per=30)
-@bot.command(hidden=True)
+@commands.command(hidden=True)
 async def load(ctx, extension_name: str):
     """Loads an extension."""
-    if await bot.is_owner(ctx.message.author):
+    if await ctx.bot.is_owner(ctx.message.author):
         try:
-            bot.load_extension(extension_name)
+            ctx.bot.load_extension(extension_name)
         except (AttributeError, ImportError) as err:
             await ctx.send('```py\n{}: {}\n```'.format(type(err).__name__, str(err)))
             return
@@ -124,17 +110,17 @@ async def load(ctx, extension_name: str):
 
 
 @commands.cooldown(rate=7, per=30)
-@bot.command(hidden=True)
+@commands.command(hidden=True)
 async def reload(ctx, extension_name: str):
     """Unloads and then reloads an extension."""
-    if await bot.is_owner(ctx.message.author):
+    if await ctx.bot.is_owner(ctx.message.author):
         try:
-            bot.unload_extension(extension_name)
+            ctx.bot.unload_extension(extension_name)
             await ctx.send('{} unloaded.'.format(extension_name))
         except commands.errors.CommandInvokeError:
             pass
         try:
-            bot.load_extension(extension_name)
+            ctx.bot.load_extension(extension_name)
         except (AttributeError, ImportError) as err:
             await ctx.send('```py\n{}: {}\n```'.format(type(err).__name__, str(err)))
             return
@@ -143,22 +129,29 @@ async def reload(ctx, extension_name: str):
         await ctx.send(random.choice(disses))
 
 
-@bot.command()
+@commands.command()
 @commands.cooldown(rate=3, per=30)
 async def pull(ctx):
     """Perform git pull"""
-    if await bot.is_owner(ctx.message.author):
+    if await ctx.bot.is_owner(ctx.message.author):
         result = subprocess.run(['git', 'pull', 'origin', 'master'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         await ctx.send('```yaml\n {}```'.format(result.stdout.decode('utf-8')))
     else:
         await ctx.send(random.choice(disses))
 
 
+# everything the bot does is set up in here, not when this file is imported.  Graphs are drawn in processes that
+# import it again (see render.py), and they don't need a config or a bot of their own
 if __name__ == '__main__':
+    config = prep()
     if config:
+        bot = commands.Bot(command_prefix=config['prefix'])
+        for command in (murder, unload, load, reload, pull):
+            bot.add_command(command)
         bot.config = config
-        bot.db = get_db()  # load the db file. User doesn't have to touch this
-        bot.mydatacache = dict()  # for caching data for graphing
+        # persistent settings.  User doesn't have to touch this
+        bot.db = settings.Settings('settings.db', 'db.json', DEFAULT_SETTINGS)
+        bot.mydatacache = datacache.DataCache("data_cache")  # for caching data for graphing, kept on disk
         for extension in config['extensions']:
             try:
                 bot.load_extension(extension)
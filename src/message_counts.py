@@ -0,0 +1,347 @@
+"""Reading and writing the message counts in channel_history.db
+
+Hourly counts live in the `message_counts` table of (guild_id, channel_id, hour_ts, count) rows, where hour_ts is
+the unix time at the start of an hour.  Hours without a row had no messages.  The `covered_hours` table says which
+hours of which guilds we have complete counts for, either because the bot was listening the whole hour, or because
+we filled them in from message history.
+
+The same counts are also kept at other resolutions, so graphs of any length only have to read as many rows as they
+draw points: `quarter_counts` has them per 15 minutes (quarter_ts), and `day_counts` per utc day (day_ts).  They're
+all written together, and an hour being covered means its quarters and its share of its day are too.  Quarters only
+exist for counts made since that table was added, so older hours just have nothing at that resolution.
+
+There are also rollups, which only come from messages the bot was listening for: the `rollups` table has daily and
+weekly totals per channel, per guild and per author, and `hour_of_week` has all-time totals per guild for each hour of
+the week (0 is midnight at the start of monday, utc).
+
+Reads happen wherever, but all writes go through a Writer, which does them in a thread of its own.
+"""
+import time
+import queue
+import sqlite3
+import asyncio
+import threading
+import traceback
+import concurrent.futures
+
+import numpy as np
+
+# put on a Writer's queue to tell it to stop
+STOP = object()
+
+
+# bin width in seconds: (table, name of its timestamp column)
+TABLES = {
+    900: ('quarter_counts', 'quarter_ts'),
+    3600: ('message_counts', 'hour_ts'),
+    86400: ('day_counts', 'day_ts'),
+}
+
+
+def quarter_start(timestamp):
+    """The unix timestamp of the start of the quarter hour that `timestamp` is in"""
+    return int(timestamp) // 900 * 900
+
+
+def hour_start(timestamp):
+    """The unix timestamp of the start of the hour that `timestamp` is in"""
+    return int(timestamp) // 3600 * 3600
+
+
+def day_start(timestamp):
+    """The unix timestamp of the start of the (utc) day that `timestamp` is in"""
+    return int(timestamp) // 86400 * 86400
+
+
+# the unix epoch was on a thursday, so weeks (starting on monday) are offset by this much
+WEEK_OFFSET = 4 * 86400
+
+
+def week_start(timestamp):
+    """The unix timestamp of the start of the (utc, monday-first) week that `timestamp` is in"""
+    return (int(timestamp) - WEEK_OFFSET) // 604800 * 604800 + WEEK_OFFSET
+
+
+def hour_of_week(timestamp):
+    """Which hour of the week `timestamp` is in, from 0 (monday, midnight utc) to 167"""
+    return (int(timestamp) - WEEK_OFFSET) % 604800 // 3600
+
+
+def hour_ranges(hours):
+    """Squash a sorted list of hour timestamps into a list of (start, end) ranges of consecutive hours"""
+    ranges = []
+    for hour in hours:
+        if ranges and ranges[-1][1] == hour:
+            ranges[-1][1] = hour + 3600
+        else:
+            ranges.append([hour, hour + 3600])
+    return [tuple(r) for r in ranges]
+
+
+def connect(path):
+    """Open the db.  WAL mode lets the bot read while the writer thread is in the middle of writing"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('pragma journal_mode=wal')
+    return conn
+
+
+def create_tables(conn):
+    conn.execute('create table if not exists message_counts '
+                 '(guild_id INTEGER, channel_id INTEGER, hour_ts INTEGER, count INTEGER, '
+                 'PRIMARY KEY (channel_id, hour_ts)) WITHOUT ROWID')
+    # covers the usual "all channels in a guild over some hours" query, so it never has to touch the table itself
+    conn.execute('create index if not exists message_counts_by_guild '
+                 'on message_counts (guild_id, hour_ts, channel_id, count)')
+    for width in (900, 86400):
+        table, column = TABLES[width]
+        conn.execute(f'create table if not exists {table} '
+                     f'(guild_id INTEGER, channel_id INTEGER, {column} INTEGER, count INTEGER, '
+                     f'PRIMARY KEY (channel_id, {column})) WITHOUT ROWID')
+        conn.execute(f'create index if not exists {table}_by_guild on {table} (guild_id, {column}, channel_id, count)')
+    if conn.execute('select not exists (select 1 from day_counts)').fetchone()[0]:
+        # add up whatever hours there were from before there was a day table
+        conn.execute('insert into day_counts select guild_id, channel_id, hour_ts / 86400 * 86400, sum(count) '
+                     'from message_counts group by channel_id, hour_ts / 86400')
+    conn.execute('create table if not exists covered_hours '
+                 '(guild_id INTEGER, timestamp INTEGER, PRIMARY KEY (guild_id, timestamp))')
+    # kind is 'channel', 'guild' or 'author', and says what key_id is the id of.  period is 'day' or 'week'
+    conn.execute('create table if not exists rollups '
+                 '(guild_id INTEGER, kind TEXT, period TEXT, period_ts INTEGER, key_id INTEGER, count INTEGER, '
+                 'PRIMARY KEY (guild_id, kind, period, period_ts, key_id)) WITHOUT ROWID')
+    conn.execute('create table if not exists hour_of_week '
+                 '(guild_id INTEGER, hour INTEGER, count INTEGER, PRIMARY KEY (guild_id, hour)) WITHOUT ROWID')
+    conn.commit()
+
+
+def old_channel_tables(conn):
+    """The ids of channels that still have their own table of counts, from before everything was in one table"""
+    c = conn.execute('select name from sqlite_master where type = \'table\'')
+    return [int(name) for name, in c if name.isdigit()]
+
+
+def migrate(conn, guild_of):
+    """Move counts out of the old one-table-per-channel layout into message_counts, and drop the old tables
+
+    `guild_of` is a function from channel id to guild id (or None if we can't tell).
+    Returns how many channels were moved over.
+    """
+    old_tables = old_channel_tables(conn)
+    for chan_id in old_tables:
+        guild_id = guild_of(chan_id) or 0
+        # the old tables were written when an hour ended, and labeled with the hour that was just starting
+        rows = conn.execute(f'select timestamp - 3600, sum(count) from \'{chan_id}\' group by timestamp').fetchall()
+        add_counts(conn, ((guild_id, chan_id, hour, n) for hour, n in rows))
+        add_counts(conn, ((guild_id, chan_id, day_start(hour), n) for hour, n in rows), 86400)
+        conn.execute(f'drop table \'{chan_id}\'')
+    return len(old_tables)
+
+
+def add_counts(conn, rows, width=3600):
+    """Add some (guild id, channel id, bin start, count) rows on to whatever counts are already there
+
+    `width` says which table they go in; see TABLES.
+    """
+    table, column = TABLES[width]
+    rows = list(rows)
+    conn.executemany(f'insert or ignore into {table} values (?, ?, ?, 0)', (row[:3] for row in rows))
+    conn.executemany(f'update {table} set count = count + ? where channel_id = ? and {column} = ?',
+                     ((n, chan_id, ts) for _, chan_id, ts, n in rows))
+
+
+def write_hour(conn, hour, quarters, channels=(), covered=()):
+    """Record the message counts for one hour, at every resolution
+
+    `quarters` is a dict of quarter hour start: {(guild id, channel id): count}, for quarters in the hour.  Every
+    (guild id, channel id) in `channels` gets an hourly row even if it's a zero.  The hour is marked covered for the
+    guild ids in `covered`, in the same job, so it's never covered without its counts.
+    """
+    hourly = dict.fromkeys(channels, 0)
+    for quarter, bins in quarters.items():
+        add_counts(conn, ((guild_id, chan_id, quarter, n) for (guild_id, chan_id), n in bins.items()), 900)
+        for key, n in bins.items():
+            hourly[key] = hourly.get(key, 0) + n
+    add_counts(conn, ((guild_id, chan_id, hour, n) for (guild_id, chan_id), n in hourly.items()))
+    add_counts(conn, ((guild_id, chan_id, day_start(hour), n) for (guild_id, chan_id), n in hourly.items() if n),
+               86400)
+    mark_covered(conn, covered, [hour])
+
+
+def add_rollups(conn, rollups, heatmap):
+    """Add counts on to the rollup tables
+
+    `rollups` is a dict of (guild id, kind, period, period start, key id): count,
+    and `heatmap` a dict of (guild id, hour of week): count
+    """
+    conn.executemany('insert or ignore into rollups values (?, ?, ?, ?, ?, 0)', rollups)
+    conn.executemany('update rollups set count = count + ? '
+                     'where guild_id = ? and kind = ? and period = ? and period_ts = ? and key_id = ?',
+                     ((n,) + key for key, n in rollups.items()))
+    conn.executemany('insert or ignore into hour_of_week values (?, ?, 0)', heatmap)
+    conn.executemany('update hour_of_week set count = count + ? where guild_id = ? and hour = ?',
+                     ((n,) + key for key, n in heatmap.items()))
+
+
+def mark_covered(conn, guild_ids, hours):
+    """Remember that we have complete counts for these hours in these guilds"""
+    conn.executemany('insert or ignore into covered_hours values (?, ?)',
+                     ((guild_id, hour) for guild_id in guild_ids for hour in hours))
+
+
+def covered_hours(conn, guild_id, start, end):
+    """The set of hours in [start, end) that we have complete counts for in a guild"""
+    c = conn.execute('select timestamp from covered_hours where guild_id = ? and timestamp >= ? and timestamp < ?',
+                     (guild_id, start, end))
+    return {hour for hour, in c}
+
+
+def write_backfill(conn, guild_id, hours, counts):
+    """Fill in counts for hours we weren't listening for, replacing anything partial that was there
+
+    `hours` is a sorted list of hour timestamps, and `counts` a dict of channel id: array of counts, one per quarter
+    hour of those hours.  The hourly and daily counts are added up from them.
+    """
+    ranges = hour_ranges(hours)
+    quarters = [hour + 900 * i for hour in hours for i in range(4)]
+    for width, starts in ((900, quarters), (3600, hours)):
+        table, column = TABLES[width]
+        conn.executemany(f'delete from {table} where channel_id = ? and {column} >= ? and {column} < ?',
+                         ((chan_id, start, end) for chan_id in counts for start, end in ranges))
+        conn.executemany(f'insert into {table} values (?, ?, ?, ?)',
+                         ((guild_id, chan_id, ts, int(n))
+                          for chan_id, y in counts.items()
+                          for ts, n in zip(starts, y if width == 900 else y.reshape(-1, 4).sum(axis=1)) if n > 0))
+    # days are only partly backfilled, so they get added up again from the hours
+    days = sorted({day_start(hour) for hour in hours})
+    conn.executemany('delete from day_counts where channel_id = ? and day_ts = ?',
+                     ((chan_id, day) for chan_id in counts for day in days))
+    conn.executemany('insert into day_counts select guild_id, channel_id, ?, sum(count) from message_counts '
+                     'where channel_id = ? and hour_ts >= ? and hour_ts < ? group by channel_id',
+                     ((day, chan_id, day, day + 86400) for chan_id in counts for day in days))
+    mark_covered(conn, [guild_id], hours)
+
+
+def forget_counts(conn, guild_id, channel_id=None):
+    """Throw away a guild's message counts (or just one channel's), so they get backfilled from history again
+
+    Hours are covered for a whole guild at once, so none of the guild's hours are covered afterwards either way.
+    The rollups are left alone, since they can't be made again from history.
+    """
+    for table, _ in TABLES.values():
+        if channel_id is None:
+            conn.execute(f'delete from {table} where guild_id = ?', (guild_id,))
+        else:
+            conn.execute(f'delete from {table} where channel_id = ?', (channel_id,))
+    conn.execute('delete from covered_hours where guild_id = ?', (guild_id,))
+
+
+def read_counts(conn, guild_id, start, end, width=3600):
+    """Get the message counts in [start, end) for every channel in a guild, in bins `width` seconds wide, in one query
+
+    Returns a dict of channel id: numpy array with one value per bin, for channels that have any data.
+    """
+    table, column = TABLES[width]
+    rows = conn.execute(f'select channel_id, {column}, count from {table} '
+                        f'where guild_id = ? and {column} >= ? and {column} < ?', (guild_id, start, end)).fetchall()
+    counts = dict()
+    if not rows:
+        return counts
+    chan_ids, bins, n = np.array(rows, dtype=np.int64).T
+    i = (bins - start) // width
+    for chan_id in np.unique(chan_ids):
+        y = np.zeros((end - start) // width)
+        mine = chan_ids == chan_id
+        y[i[mine]] = n[mine]
+        counts[int(chan_id)] = y
+    return counts
+
+
+def read_top(conn, guild_id, kind, period, start, limit=10):
+    """The ids with the most messages since `start` in a guild, as a list of (id, count), biggest first"""
+    c = conn.execute('select key_id, sum(count) from rollups '
+                     'where guild_id = ? and kind = ? and period = ? and period_ts >= ? '
+                     'group by key_id order by sum(count) desc limit ?', (guild_id, kind, period, start, limit))
+    return c.fetchall()
+
+
+def read_hour_of_week(conn, guild_id):
+    """All-time message counts for each hour of the week in a guild, as a numpy array of 168 values"""
+    counts = np.zeros(168)
+    for hour, n in conn.execute('select hour, count from hour_of_week where guild_id = ?', (guild_id,)):
+        counts[hour] = n
+    return counts
+
+
+class Writer:
+    """Does all the writing to the db in a thread of its own, so the bot never has to wait on the disk
+
+    Jobs are functions that take a connection as their first argument, like the ones above.  Changes are committed
+    every `flush_interval` seconds, or straight away for jobs that someone is waiting on.
+    """
+
+    def __init__(self, path, flush_interval=60):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.work, name='message count writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args):
+        """Queue up a job to be done soon, without waiting for it"""
+        self.jobs.put((func, args, None))
+
+    async def run(self, func, *args):
+        """Queue up a job, and wait until it's done and committed.  Returns whatever the job returns"""
+        future = concurrent.futures.Future()
+        self.jobs.put((func, args, future))
+        return await asyncio.wrap_future(future)
+
+    async def flush(self):
+        """Wait until everything queued up so far is written and committed"""
+        await self.run(lambda conn: None)
+
+    def close(self):
+        """Write out everything that's been queued up, and stop the thread"""
+        self.jobs.put(STOP)
+        self.thread.join()
+
+    def work(self):
+        conn = connect(self.path)
+        next_commit = None  # when we should commit by, if there's anything not committed yet
+        while True:
+            # sleep until there's a job, or until it's time to commit what we've got
+            timeout = None if next_commit is None else max(0, next_commit - time.monotonic())
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                conn.commit()
+                next_commit = None
+                continue
+            if job is STOP:
+                conn.commit()
+                conn.close()
+                return
+
+            func, args, future = job
+            # each job gets a savepoint, so one that fails partway doesn't leave half its writes to be committed
+            if not conn.in_transaction:
+                conn.execute('begin')
+            conn.execute('savepoint job')
+            try:
+                result = func(conn, *args)
+            except Exception as e:
+                conn.execute('rollback to job')
+                conn.execute('release job')
+                if future is None:
+                    traceback.print_exc()
+                else:
+                    future.set_exception(e)
+                continue
+            conn.execute('release job')
+            if future is None:
+                if next_commit is None:
+                    next_commit = time.monotonic() + self.flush_interval
+            else:
+                # someone's waiting to read what this wrote
+                conn.commit()
+                next_commit = None
+                future.set_result(result)
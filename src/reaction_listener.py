@@ -1,8 +1,43 @@
+import time
 import asyncio
 from datetime import datetime, timedelta
+from collections import OrderedDict
 from discord.ext import commands
 import discord
 
+# how long (in seconds) after the last reaction to a message we keep editing its log message instead of sending more
+REMEMBER_FOR = 120
+# and the most messages we keep track of at once, however many get reacted to
+MAX_TRACKED = 1000
+# seconds to wait after a reaction before editing its log message, so a burst of reactions becomes one edit
+EDIT_DELAY = 2
+
+
+class Reactions:
+    """What we're keeping track of about an old message that people are reacting to"""
+    __slots__ = ('last_seen', 'link', 'log_message', 'count', 'users', 'last_user', 'edit')
+
+    def __init__(self, link, user_id):
+        self.last_seen = time.monotonic()
+        self.link = link
+        self.log_message = None  # the discord.Message we logged it in, once it's been sent
+        self.count = 1
+        self.users = {user_id}
+        self.last_user = user_id
+        self.edit = None  # the timer for the next edit of the log message, if one is coming
+
+    def add(self, user_id):
+        self.last_seen = time.monotonic()
+        self.count += 1
+        self.users.add(user_id)
+        self.last_user = user_id
+
+    def content(self):
+        if len(self.users) == 1:
+            return f'<@{self.last_user}> reacted to the old message {self.link} (x{self.count})'
+        return (f'{len(self.users)} people reacted to the old message {self.link} (x{self.count}), '
+                f'most recently <@{self.last_user}>')
+
 
 class ReactionListener(commands.Cog):
     """Log emoji reactions to messages way way back
@@ -13,49 +48,126 @@ class ReactionListener(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        # dict of id of message reacted to, pointing towards (time of last reaction, reaction logging message, count)
-        self.log_msgs = dict()
-        self.max_age = bot.db['REACTION']['max_age']  # days
-
-    def cleanup(self):
-        """keep self.log_msgs small"""
-        old_keys = []
-        for key in self.log_msgs:
-            if datetime.utcnow() - self.log_msgs[key][0] > timedelta(seconds=120):
-                old_keys.append(key)
-        for key in old_keys:
-            self.log_msgs.pop(key)
+        # id of message reacted to, pointing towards its Reactions
+        # Kept in order of last reaction, oldest first, so old ones can be dropped from the front
+        self.log_msgs = OrderedDict()
+        # messages with ids below this are old enough to log reactions to, and these guilds have somewhere to log them.
+        # Both are worked out ahead of time, so most reactions can be ignored without looking anything else up
+        self.cutoff = 0
+        self.enabled = set()
+        self.refresh_settings()
+        # how many reactions took how long to handle: bucket i counts the ones that took under 2**i microseconds
+        self.latency = [0] * 40
+        self.cleanup_task = self.bot.loop.create_task(self.cleanup())
+
+    def cog_unload(self):
+        self.cleanup_task.cancel()
+        for reactions in self.log_msgs.values():
+            if reactions.edit is not None:
+                reactions.edit.cancel()
+
+    def touch(self, message_id, reactions):
+        """Remember a reaction to a message, moving it to the back of the line to be forgotten"""
+        self.log_msgs[message_id] = reactions
+        self.log_msgs.move_to_end(message_id)
+        while len(self.log_msgs) > MAX_TRACKED:
+            self.log_msgs.popitem(last=False)
+
+    def forget_old(self):
+        """Drop messages nobody has reacted to for a while.  Only looks at the ones it drops, plus one"""
+        cutoff = time.monotonic() - REMEMBER_FOR
+        while self.log_msgs and next(iter(self.log_msgs.values())).last_seen < cutoff:
+            self.log_msgs.popitem(last=False)
+
+    def refresh_settings(self):
+        """Work out the cutoff id and which guilds log reactions, from the current settings"""
+        max_age = self.bot.db.get('REACTION', 'max_age', 3)  # days
+        self.cutoff = discord.utils.time_snowflake(datetime.utcnow() - timedelta(days=max_age))
+        self.enabled = {int(guild_id) for guild_id in self.bot.db.get('REACTION', 'log_channels', dict())}
+
+    async def cleanup(self):
+        """Background task to keep self.log_msgs small, and the cutoff moving along with the time"""
+        while True:
+            await asyncio.sleep(REMEMBER_FOR / 4)
+            self.forget_old()
+            self.refresh_settings()
+
+    def schedule_edit(self, reactions):
+        """Edit the log message in a bit, unless that's already going to happen"""
+        if reactions.edit is None:
+            reactions.edit = self.bot.loop.call_later(EDIT_DELAY, self.start_edit, reactions)
+
+    def start_edit(self, reactions):
+        reactions.edit = None
+        if reactions.log_message is None:
+            # still sending the first log message, so try again later
+            self.schedule_edit(reactions)
+        else:
+            self.bot.loop.create_task(self.edit_log(reactions))
+
+    async def edit_log(self, reactions):
+        """Bring the log message up to date with all the reactions since it was last edited"""
+        try:
+            await reactions.log_message.edit(content=reactions.content())
+        except (discord.errors.NotFound, discord.errors.Forbidden, discord.errors.HTTPException):
+            pass
 
     # https://discordpy.readthedocs.io/en/latest/api.html#discord.on_raw_reaction_add
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, event):
-        self.cleanup()  # this should be called every so often
+        start = time.perf_counter()
+        # only concern ourselves with reactions to ancient posts, in guilds that want them logged
+        try:
+            if event.message_id < self.cutoff and event.guild_id in self.enabled:
+                await self.log_reaction(event)
+        finally:
+            self.latency[int((time.perf_counter() - start) * 1e6).bit_length()] += 1
 
+    async def log_reaction(self, event):
         # Logging channels: a dict of str(server ids) pointing to log channel ids
         log_channels = self.bot.db['REACTION']['log_channels']
-        # only concern ourselves with reactions to ancient posts
-        if datetime.utcnow() - discord.utils.snowflake_time(event.message_id) > timedelta(days=self.max_age):
-            link = f'https://discordapp.com/channels/{event.guild_id}/{event.channel_id}/{event.message_id}'
-            if str(event.guild_id) in log_channels:
-                log_chan = self.bot.get_channel(log_channels[str(event.guild_id)])
-
-                # this is the first log for them reacting on this message
-                if event.message_id not in self.log_msgs:
-                    log_message = await log_chan.send(f'<@{event.user_id}> reacted to the old message {link} (x1)')
-                    self.log_msgs[event.message_id] = (datetime.utcnow(), log_message.id, 1)
-
-                # they reacted recently, so don't send a whole new message about this
-                else:
-                    _, log_message_id, n = self.log_msgs[event.message_id]
-                    n += 1
-                    self.log_msgs[event.message_id] = (datetime.utcnow(), log_message_id, n)
-                    try:
-                        log_message = await log_chan.fetch_message(log_message_id)
-                    except (discord.errors.NotFound, discord.errors.Forbidden, discord.errors.HTTPException):
-                        pass
-                    else:
-                        await asyncio.sleep(n/5)  # slight delay.  This makes the count accurate for rapid additions
-                        await log_message.edit(content=f'<@{event.user_id}> reacted to the old message {link} (x{n})')
+        if str(event.guild_id) not in log_channels:
+            return
+        link = f'https://discordapp.com/channels/{event.guild_id}/{event.channel_id}/{event.message_id}'
+        log_chan = self.bot.get_channel(log_channels[str(event.guild_id)])
+
+        reactions = self.log_msgs.get(event.message_id)
+        # this is the first log for them reacting on this message (or the last one was a while ago, and just hasn't
+        # been cleaned up yet)
+        if reactions is None or reactions.last_seen < time.monotonic() - REMEMBER_FOR:
+            reactions = Reactions(link, event.user_id)
+            # remember it before sending, so reactions that come in while it sends are counted, not logged again
+            self.touch(event.message_id, reactions)
+            try:
+                reactions.log_message = await log_chan.send(reactions.content())
+            except discord.errors.HTTPException:
+                if self.log_msgs.get(event.message_id) is reactions:
+                    del self.log_msgs[event.message_id]
+                if reactions.edit is not None:
+                    reactions.edit.cancel()
+                raise
+
+        # they reacted recently, so don't send a whole new message about this.  All the reactions in the next few
+        # seconds get counted in one edit
+        else:
+            reactions.add(event.user_id)
+            self.touch(event.message_id, reactions)
+            self.schedule_edit(reactions)
+
+    @commands.command()
+    @commands.is_owner()
+    async def reaction_latency(self, ctx):
+        """Show how long handling each reaction has taken, since the bot started"""
+        total = sum(self.latency)
+        if not total:
+            await ctx.send('No reactions yet')
+            return
+        last = max(i for i, n in enumerate(self.latency) if n)
+        first = min(i for i, n in enumerate(self.latency) if n)
+        widest = max(self.latency)
+        lines = [f'< {2 ** i:>9} µs {n:>9} {"#" * round(n / widest * 30)}' for i, n in
+                 enumerate(self.latency[first:last + 1], first)]
+        await ctx.send('```\n' + '\n'.join(lines) + f'\n{total} reactions```')
 
 
 def setup(bot):
@@ -0,0 +1,179 @@
+"""Graph drawing, done in worker processes.
+
+Everything in here that runs in a worker only gets plain data (numpy arrays, strings) and hands back png bytes,
+so nothing about the bot has to be pickled, and the bot keeps talking to discord while matplotlib chugs away.
+We use the object-oriented Figure api rather than pyplot, so there's no global figure state to trip over.
+"""
+import io
+import asyncio
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+import matplotlib.dates as mdates
+import matplotlib.colors as colors
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+try:
+    from matplotlib import colormaps
+
+    def get_cmap(name):
+        return colormaps[name]
+except ImportError:  # matplotlib < 3.5
+    from matplotlib.cm import get_cmap
+
+
+# Graph styling
+STYLE = {
+    'legend.frameon': False,
+    'figure.figsize': [9, 6],
+    'savefig.facecolor': '#2C2F33',
+    'axes.facecolor': '#2C2F33',
+    'axes.labelcolor': '#999999',
+    'xtick.color': '#999999',
+    'ytick.color': '#999999',
+}
+
+
+class QueueFull(Exception):
+    """Raised when there are already too many graphs waiting to be drawn"""
+
+
+# matplotlib's number for the unix epoch.  This depends on the matplotlib version, so don't hardcode it
+EPOCH_DATENUM = mdates.date2num(datetime.datetime(1970, 1, 1))
+
+
+def datenums(timestamps):
+    """Convert an array of unix timestamps to matplotlib date numbers (in utc), all at once"""
+    return np.asarray(timestamps, dtype=np.float64) / 86400 + EPOCH_DATENUM
+
+
+def gradient_line(x, y, colormap, norm, label):
+    """A line colored along its length by its height, as one LineCollection
+
+    Stolen idea from SO:
+    https://stackoverflow.com/questions/8500700/how-to-plot-a-gradient-color-line-in-matplotlib/25941474#25941474"""
+    points = np.column_stack([x, y])
+    # one segment between each pair of neighboring points, colored by the height of its middle
+    segments = np.stack([points[:-1], points[1:]], axis=1)
+    line = LineCollection(segments, cmap=colormap, norm=norm, linewidths=3, capstyle='round', label=label)
+    line.set_array((y[:-1] + y[1:]) / 2)
+    return line
+
+
+def date_ticks(span):
+    """A (locator, formatter) for the x axis that gives a sensible number of ticks over `span` seconds"""
+    days = span / 86400
+    if days <= 14:
+        return mdates.DayLocator(), mdates.DateFormatter('%d/%m')
+    if days <= 120:
+        return mdates.WeekdayLocator(), mdates.DateFormatter('%d/%m')
+    return mdates.MonthLocator(), mdates.DateFormatter('%b')
+
+
+def preplot_styling(x, ylabel):
+    """Make a figure and configure the graph style, before calling the plot functions"""
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.set_ylabel(ylabel)
+    locator, formatter = date_ticks(x[-1] - x[0])
+    ax.xaxis.set_major_formatter(formatter)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis_date()
+    ax.set_xlim(datenums([x[0], x[-1]]))
+    for pos in ('top', 'bottom', 'left', 'right'):
+        ax.spines[pos].set_visible(False)
+    return fig, ax
+
+
+def postplot_styling(fig, ax, series):
+    """Configure the graph style, after calling any plotting functions"""
+    # legends and tweaks
+    legend = ax.legend(loc='upper left', prop={'size': 13}, handlelength=0)
+    # set legend labels to the right color
+    for text, (_, _, colormap) in zip(legend.get_texts(), series):
+        text.set_color(get_cmap(colormap)(.5))
+    # get rid of the (usually colored) dots next to the text entries in the legend
+    handles = legend.legend_handles if hasattr(legend, 'legend_handles') else legend.legendHandles
+    for item in handles:
+        item.set_visible(False)
+    # grid layout
+    ax.grid(True, 'major', 'x', ls=':', lw=.5, c='w', alpha=.2)
+    ax.grid(True, 'major', 'y', ls=':', lw=.5, c='w', alpha=.2)
+    fig.tight_layout()
+
+
+def as_png(fig):
+    """Save the figure to png, and return the bytes of it"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def line_graph(x, series, ylabel='Messages per hour'):
+    """Draw a smooth line graph of messages over time.  Runs in a worker process.
+
+    `x` is an array of unix timestamps, evenly spaced, and `series` a list of (channel name, y values, colormap name)
+    tuples.  Returns the png as bytes.
+    """
+    with matplotlib.rc_context(STYLE):
+        fig, ax = preplot_styling(x, ylabel)
+        # we need this so that colormaps for each series stretch to the global max, rather than the max of that series
+        global_max = max(y.max() for _, y, _ in series)
+        # stretch the colormap; we don't use extremes cuz they ugly
+        norm = colors.Normalize(vmin=-global_max / 1.5, vmax=global_max * 2.5)
+        xs = datenums(x)
+        for name, y, colormap in series:
+            ax.add_collection(gradient_line(xs, y, colormap, norm, name))
+        # adding collections doesn't resize the axes like plotting does
+        ax.set_ylim(-global_max * .03, global_max * 1.05)
+        postplot_styling(fig, ax, series)
+        return as_png(fig)
+
+
+def bar_graph(x, series, ylabel='Messages per hour'):
+    """Draw a bar chart of messages over time.  Runs in a worker process.
+
+    Takes the same arguments as `line_graph`, and also returns png bytes.
+    """
+    with matplotlib.rc_context(STYLE):
+        fig, ax = preplot_styling(x, ylabel)
+        xs = datenums(x)
+        # bars are a tenth of a day wide, so you can see them at all, unless the bins are wider than that
+        width = max(.1, (x[1] - x[0]) / 86400 * .8) if len(x) > 1 else .1
+        for name, y, colormap in series:
+            ax.bar(xs, y, width, label=name, alpha=.3, color=get_cmap(colormap)(.5))
+        postplot_styling(fig, ax, series)
+        return as_png(fig)
+
+
+class Renderer:
+    """Hands graphs off to a pool of worker processes
+
+    At most `workers` graphs get drawn at once, and at most `queue_depth` more are allowed to wait for a free worker.
+    Past that, `render` raises QueueFull rather than letting requests pile up forever.
+    """
+
+    def __init__(self, workers=2, queue_depth=8):
+        # workers mustn't be forked from the bot, which has threads of its own going by the time the first graph is
+        # drawn.  forkserver forks them from a clean process instead, and windows only has spawn
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.slots = asyncio.Semaphore(workers + queue_depth)
+
+    async def render(self, func, *args):
+        """Run one of the graph functions above in the pool, and return the png bytes it makes"""
+        if self.slots.locked():
+            raise QueueFull()
+        async with self.slots:
+            return await asyncio.get_event_loop().run_in_executor(self.pool, func, *args)
+
+    def shutdown(self):
+        """Stop the worker processes.  Graphs still being drawn are abandoned"""
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,70 @@
+"""The bot's persistent settings (what used to be db.json), kept in sqlite
+
+Settings are grouped into sections like 'ACTIVITY' or 'REACTION', each of which has keys with json values.  Every
+setting is read into memory when the bot starts, so reading one never touches the disk, and changing one only writes
+that one row, in a thread of its own.
+"""
+import os
+import json
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Settings:
+    """Acts like the old db dict for reading: `settings['REACTION']['max_age']`.  Change things with `set`
+
+    The first time, settings are imported from the json file at `import_path` if there is one, which then gets renamed
+    so it's clear it isn't used anymore.  Otherwise it starts off with `defaults`, a dict of section: {key: value}.
+    """
+
+    def __init__(self, path, import_path='db.json', defaults=None):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('create table if not exists settings '
+                          '(section TEXT, key TEXT, value TEXT, PRIMARY KEY (section, key)) WITHOUT ROWID')
+        # one thread, so changes get written in the order they were made
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        if not self.conn.execute('select exists (select 1 from settings)').fetchone()[0]:
+            self.first_time(import_path, defaults or dict())
+        self.sections = dict()
+        for section, key, value in self.conn.execute('select section, key, value from settings'):
+            self.sections.setdefault(section, dict())[key] = json.loads(value)
+
+    def first_time(self, import_path, defaults):
+        """Fill in the settings from the old json file, or from the defaults if there isn't one"""
+        try:
+            with open(import_path) as f:
+                sections = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            print('Didn\'t find any settings, so starting with the defaults')
+            sections = defaults
+        else:
+            print(f'Importing settings from {import_path}')
+        with self.conn:
+            self.conn.executemany('insert into settings values (?, ?, ?)',
+                                  ((section, key, json.dumps(value))
+                                   for section, keys in sections.items() for key, value in keys.items()))
+        if os.path.exists(import_path):
+            os.replace(import_path, import_path + '.imported')
+
+    def __getitem__(self, section):
+        """All the settings in a section, as a dict.  Don't change it directly, or the change won't be saved"""
+        return self.sections.setdefault(section, dict())
+
+    def get(self, section, key, default=None):
+        return self.sections.get(section, dict()).get(key, default)
+
+    async def set(self, section, key, value):
+        """Change a setting.  It changes in memory straight away, and this returns once it's on disk"""
+        # go through json and back, so what's in memory is the same as what we'd get from disk next time
+        text = json.dumps(value)
+        self.sections.setdefault(section, dict())[key] = json.loads(text)
+        await asyncio.get_event_loop().run_in_executor(self.executor, self.write, section, key, text)
+
+    def write(self, section, key, text):
+        with self.conn:
+            self.conn.execute('insert or replace into settings values (?, ?, ?)', (section, key, text))
+
+    def close(self):
+        self.executor.shutdown()
+        self.conn.close()
@@ -0,0 +1,67 @@
+"""Gaussian smoothing for message counts, with just numpy
+
+This gives the same numbers as scipy.ndimage.gaussian_filter1d (with its default 'reflect' mode and truncate=4),
+but without having to import all of scipy.  Kernels are only ever made once for each sigma.
+"""
+import functools
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def kernel(sigma, truncate=4.0):
+    """The normalized gaussian kernel for a sigma, reaching out `truncate` sigmas on either side"""
+    radius = int(truncate * sigma + .5)
+    x = np.arange(-radius, radius + 1)
+    k = np.exp(-.5 * (x / sigma) ** 2)
+    k /= k.sum()
+    k.setflags(write=False)  # it's shared by everyone, so nobody gets to change it
+    return k
+
+
+def smooth(y, sigma):
+    """Smooth a series with a gaussian.  A sigma of 1 or less leaves it as it is"""
+    if sigma <= 1:
+        return np.asarray(y, dtype=np.float64)
+    k = kernel(sigma)
+    radius = len(k) // 2
+    # numpy's 'symmetric' is the same as scipy's 'reflect': the edge value gets repeated
+    padded = np.pad(np.asarray(y, dtype=np.float64), radius, mode='symmetric')
+    return np.convolve(padded, k, mode='valid')
+
+
+class StreamingSmoother:
+    """A sliding window over a series that keeps a smoothed version of it up to date
+
+    Adding values to the end (or dropping them from the start) only recomputes the smoothed values close enough to
+    that end for the kernel to reach, rather than the whole series.
+    """
+
+    def __init__(self, y, sigma):
+        self.sigma = sigma
+        self.radius = len(kernel(sigma)) // 2 if sigma > 1 else 0
+        self.raw = np.asarray(y, dtype=np.float64)
+        self.smoothed = smooth(self.raw, sigma)
+
+    def append(self, values):
+        """Add new values on the end of the series"""
+        n_old = len(self.raw)
+        self.raw = np.concatenate([self.raw, np.asarray(values, dtype=np.float64)])
+        # anything within a radius of the old end was reflected off of it, so has to be redone
+        first = n_old - self.radius
+        if first - self.radius < 0:
+            self.smoothed = smooth(self.raw, self.sigma)
+            return
+        # redo from `first` on, using a radius of real values to its left, and reflecting off the new end
+        tail = smooth(self.raw[first - self.radius:], self.sigma)[self.radius:]
+        self.smoothed = np.concatenate([self.smoothed[:first], tail])
+
+    def drop(self, n):
+        """Forget the first n values of the series"""
+        self.raw = self.raw[n:]
+        if len(self.raw) < 4 * self.radius:
+            self.smoothed = smooth(self.raw, self.sigma)
+            return
+        # only values within a radius of the new start can see the start
+        head = smooth(self.raw[:3 * self.radius], self.sigma)[:self.radius]
+        self.smoothed = np.concatenate([head, self.smoothed[n + self.radius:]])